@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+import sys
+import time
+import hashlib
+import threading
+
+from array import array
+from collections import OrderedDict
+from typing import Union
+
+import consoles
+from framebuffer import FrameBuffer, RunLengthFrames
+
+BLOCK_FRAMES = 256
+CHUNK_FRAMES = 1 << 16
+
+class ActivityIndex:
+    '''
+    How much the input changes in every block of frames of a movie.
+
+    changes[0][i] counts the frames of block i whose input differs from the
+    frame before, held[0][i] the frames of block i with any button or axis
+    away from zero. Every level above sums pairs of the level below, so a
+    view of any zoom can be drawn from about one entry per pixel without
+    looking at the frames again.
+    '''
+
+    __slots__ = ('length', 'block', 'changes', 'held')
+
+    def __init__(self, frames: Union[FrameBuffer, RunLengthFrames], block: int = BLOCK_FRAMES) -> None:
+
+        self.length = len(frames)
+        self.block = block
+        stride = frames.stride
+        changes = array('I')
+        held = array('I')
+        previous = bytes(stride)
+        #Whole blocks per chunk keep the big integers small
+        chunk = max(1, CHUNK_FRAMES // block) * block
+        for start in range(0, self.length, chunk):
+            stop = min(start + chunk, self.length)
+            n = stop - start
+            data = bytes(frames.frames(start, stop))
+            shifted = previous + data[:-stride]
+            previous = data[-stride:]
+            xor = (int.from_bytes(data, 'little') ^ int.from_bytes(shifted, 'little')).to_bytes(len(data), 'little')
+            changed = 0
+            nonzero = 0
+            for column in range(stride):
+                changed |= int.from_bytes(xor[column::stride], 'little')
+                nonzero |= int.from_bytes(data[column::stride], 'little')
+            changed = changed.to_bytes(n, 'little')
+            nonzero = nonzero.to_bytes(n, 'little')
+            for offset in range(0, n, block):
+                size = min(block, n - offset)
+                changes.append(size - changed.count(0, offset, offset + size))
+                held.append(size - nonzero.count(0, offset, offset + size))
+        self.changes = [changes]
+        self.held = [held]
+        while len(changes) > 1:
+            changes = self._halve(changes)
+            held = self._halve(held)
+            self.changes.append(changes)
+            self.held.append(held)
+
+    @staticmethod
+    def _halve(level: array) -> array:
+
+        pairs = array('I', level[0::2])
+        for i, value in enumerate(level[1::2]):
+            pairs[i] += value
+        return pairs
+
+    def level_for(self, frames_per_pixel: float) -> int:
+
+        #Coarsest level whose entries still cover at most one pixel
+        level = 0
+        while level + 1 < len(self.changes) and self.block << (level + 1) <= frames_per_pixel:
+            level += 1
+        return level
+
+    def span(self, level: int, start: int, stop: int) -> tuple:
+
+        #(changed frames, frames held, frames counted) between frames start and stop
+        size = self.block << level
+        first = max(0, start // size)
+        last = min(len(self.changes[level]), max(first + 1, -(-stop // size)))
+        changes = sum(self.changes[level][first:last])
+        held = sum(self.held[level][first:last])
+        counted = min(self.length, last * size) - first * size
+        return changes, held, counted
+
+_cache: OrderedDict = OrderedDict()
+_cache_lock = threading.Lock()
+CACHE_SIZE = 8
+
+def movie_index(console: str, data: bytes, players: list, block: int = BLOCK_FRAMES) -> ActivityIndex:
+
+    #Activity index of a movie, built once and kept for the most recent movies.
+    #Safe to call from several threads; the index itself is built unlocked
+    digest = hashlib.blake2b(data, digest_size = 16).digest()
+    key = (consoles.get(console).name, tuple(players), block, digest)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    fmt = consoles.get(console)
+    frames = FrameBuffer.from_frames(fmt.decode(data, players), fmt.frame_size * len(players))
+    index = ActivityIndex(frames, block)
+    with _cache_lock:
+        _cache[key] = index
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last = False)
+    return index
+
+def main():
+    try:
+        console = sys.argv[1]
+        file = sys.argv[2]
+    except:
+        print(f'Usage {sys.argv[0]} <console> <movie file> [players]')
+        sys.exit()
+    players = [int(x) for x in sys.argv[3].split(',')] if len(sys.argv) > 3 else [1]
+    with open(file, 'rb') as f:
+        data = f.read()
+    t0 = time.perf_counter()
+    index = movie_index(console, data, players)
+    t1 = time.perf_counter()
+    idle = sum(1 for value in index.changes[0] if value == 0)
+    print(f'{index.length} frames in {len(index.changes[0])} blocks of {index.block}, {idle} blocks without changes')
+    print(f'Built in {t1 - t0:.3f} s')
+
+if __name__ == '__main__':
+    main()
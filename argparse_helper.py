@@ -2,6 +2,8 @@
 import argparse
 import sys
 
+import consoles
+
 def setup_parser():
     parser = argparse.ArgumentParser(description='...')
     parser.add_argument('--serial', help='Preselect the serial port')
@@ -13,7 +15,7 @@ def setup_parser_full():
     parser = argparse.ArgumentParser(description='...')
     parser.add_argument('--serial', help='Preselect the serial port')
     parser.add_argument('--blank', help='Number of blank frames to prepend to input', type=int, default=0)
-    parser.add_argument('--console', help='Set the console', choices=['n64', 'snes', 'nes', 'gc', 'genesis'], required=True)
+    parser.add_argument('--console', help='Set the console', choices=list(consoles.CONSOLES), required=True)
     parser.add_argument('--players', help='Comma seperated list of players', default='1')
     parser.add_argument('--debug', help='Enable Debug Mode', action='store_true')
     parser.add_argument('--dpcm', help='Enable dpcm fix', action='store_true')
@@ -24,10 +26,97 @@ def setup_parser_full():
     parser.add_argument('--transition', help='Add a transition', nargs=2, action='append')
     parser.add_argument('--latchtrain', help='Configure latch train', default='')
     parser.add_argument('--nobulk', help='Disable Bulk Transfer Mode', action='store_true')
+    parser.add_argument('--start', help='Frame of the movie to start playback from', type=int, default=0)
+    parser.add_argument('--jobs', help='Processes used to decode long movies (0 for one per core)', type=int, default=1)
+    parser.add_argument('--capture', help='Log everything sent to and received from the device to this file')
+    parser.add_argument('--metrics-port', help='Serve replay metrics for Prometheus on this localhost port', type=int)
+    parser.add_argument('--metrics-file', help='Keep replay metrics in Prometheus text format in this file')
+    parser.add_argument('--trace', help='Write how long each stage of the run took to this Chrome trace file')
+    parser.add_argument('--profile', help='Profile the main loop with cProfile and write the stats to this file')
     # parser.add_argument('--window', help='Set window mode', type=float, default=0)
     parser.add_argument('movie', help='Path to the movie file to play')
     return parser
 
+def compile_parser():
+    parser = argparse.ArgumentParser(description='Compile a movie into a ready to stream file for tastm32.py')
+    parser.add_argument('--console', help='Set the console', choices=list(consoles.CONSOLES))
+    parser.add_argument('--players', help='Comma seperated list of players', default='1')
+    parser.add_argument('--blank', help='Number of blank frames to prepend to input', type=int, default=0)
+    parser.add_argument('--dpcm', help='Enable dpcm fix', action='store_true')
+    parser.add_argument('--clock', help='Enable clock filter. Value must be between 0 and 63. This number gets multiplied by 0.25us')
+    parser.add_argument('--overread', help='Set overread value', action='store_true')
+    parser.add_argument('--prefix', help='Run prefix the device will assign', choices=['A', 'B', 'C', 'D'], default='A')
+    parser.add_argument('--output', help='Path of the compiled stream (default: movie path + .tstm)')
+    parser.add_argument('--verify', help='Check the checksum of an existing compiled stream instead', action='store_true')
+    parser.add_argument('movie', help='Path to the movie file to compile')
+    return parser
+
+def diff_parser():
+    parser = argparse.ArgumentParser(description='Find where two movies or .tas files stop having the same inputs')
+    parser.add_argument('--console', help='Console of raw movies whose extension is ambiguous', choices=list(consoles.CONSOLES))
+    parser.add_argument('--players', help='Comma seperated list of players of raw movies', default='1')
+    parser.add_argument('--block', help='Frames per hashed block', type=int, default=4096)
+    parser.add_argument('--limit', help='Number of differing frames to list', type=int, default=10)
+    parser.add_argument('old', help='Path to the first movie or .tas file')
+    parser.add_argument('new', help='Path to the second movie or .tas file')
+    return parser
+
+def sweep_parser():
+    parser = argparse.ArgumentParser(description='Try combinations of sync settings of a .tas file on one TAStm32')
+    parser.add_argument('--serial', help='Preselect the serial port')
+    parser.add_argument('--blank', help='Comma seperated blank frame counts to try')
+    parser.add_argument('--clock', help='Comma seperated clock filter values (0 to 63) to try')
+    parser.add_argument('--dpcm', help='Dpcm fix settings to try, e.g. 0,1')
+    parser.add_argument('--overread', help='Overread settings to try, e.g. 0,1')
+    parser.add_argument('--latchtrain', dest='latch_train', help='Semicolon seperated latch trains to try')
+    parser.add_argument('--bisect', help='Search LOW..HIGH of --blank or --clock for the smallest value that works', choices=['blank', 'clock'])
+    parser.add_argument('--frames', help='Frames each attempt has to reach (default: the whole movie)', type=int)
+    parser.add_argument('--idle', help='Seconds without latches after which an attempt is given up', type=float, default=5.0)
+    parser.add_argument('--reset', help='Power cycle before each attempt', choices=['hard reset', 'soft reset', 'none'])
+    parser.add_argument('--log', help='Append the outcome of every attempt to this JSON lines file')
+    parser.add_argument('--verbose', help='Show the output of every attempt', action='store_true')
+    parser.add_argument('run', help='Path to the .tas file to sweep')
+    return parser
+
+def daemon_parser():
+    parser = argparse.ArgumentParser(description='Replay .tas files on TAStm32s from a background service')
+    parser.add_argument('--port', help='Local TCP port of the control API', type=int, default=8732)
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help='Own the given serial ports and wait for jobs')
+    serve.add_argument('--serial', help='Serial port to own, can be given more than once', action='append', required=True)
+    serve.add_argument('--logs', help='Directory for the output of every job (default: a new temporary directory)')
+    run = commands.add_parser('run', help='Start replaying a .tas file')
+    run.add_argument('--serial', help='Port to replay on (default: the first idle one)')
+    run.add_argument('--overrides', help='JSON object of replay settings to use instead of the ones in the file')
+    run.add_argument('--watch', help='Follow the output until the replay ends', action='store_true')
+    run.add_argument('run', help='Path to the .tas file')
+    watch = commands.add_parser('watch', help='Follow the output of a job')
+    watch.add_argument('job', type=int)
+    stop = commands.add_parser('stop', help='Stop a job')
+    stop.add_argument('job', type=int)
+    commands.add_parser('status', help='List the ports and jobs')
+    return parser
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Build .tas files for a whole library of movies')
+    parser.add_argument('--output', help='Directory to write the .tas files to, mirroring the input (default: next to each movie)')
+    parser.add_argument('--jobs', help='Runs built at once (0 for one per core)', type=int, default=0)
+    parser.add_argument('--raw', help='Store movies as they are instead of in compressed blocks', action='store_true')
+    parser.add_argument('--frame-count', help='Record the frame count of each movie in run.json', action='store_true')
+    parser.add_argument('--hash', help='Record the SHA-256 of each movie in run.json', action='store_true')
+    parser.add_argument('--compiled', help='Also store a compiled stream for tastm32.py of each movie', action='store_true')
+    parser.add_argument('--force', help='Rebuild .tas files that already exist', action='store_true')
+    parser.add_argument('source', help='Directory of movies, or a JSON manifest of runs')
+    return parser
+
+def capture_parser():
+    parser = argparse.ArgumentParser(description='Show or replay a TAStm32 capture log')
+    parser.add_argument('--replay', help='Run main_loop against the capture and compare what it sends', action='store_true')
+    parser.add_argument('--movie', help='Movie, .tas file or compiled stream to replay with instead of the captured path')
+    parser.add_argument('--limit', help='Number of records to show', type=int, default=200)
+    parser.add_argument('capture', help='Path to the capture log')
+    return parser
+
 def audio_parser():
     parser = argparse.ArgumentParser(description='...')
     parser.add_argument('--serial', help='Preselect the serial port')
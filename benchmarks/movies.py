@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+import random
+import struct
+
+#Synthetic movies in each supported format. Inputs are random but seeded so every
+#benchmark run decodes exactly the same bytes.
+
+def _inputs(frames: int, stride: int, seed: int) -> bytes:
+
+    rng = random.Random(seed)
+    return rng.randbytes(frames * stride)
+
+def r08(frames: int, seed: int = 0) -> bytes:
+
+    return _inputs(frames, 2, seed)
+
+def r16m(frames: int, seed: int = 0) -> bytes:
+
+    return _inputs(frames, 16, seed)
+
+def rgen(frames: int, seed: int = 0) -> bytes:
+
+    return _inputs(frames, 4, seed)
+
+def m64(frames: int, controllers: int = 1, seed: int = 0) -> bytes:
+
+    header = bytearray(0x400)
+    struct.pack_into('<4sIIII', header, 0, b'M64\x1a', 3, 0, frames, 0)
+    struct.pack_into('<BB', header, 0x14, 60, controllers)
+    struct.pack_into('<I', header, 0x18, frames)
+    return bytes(header) + _inputs(frames, 4 * controllers, seed)
+
+def dtm(frames: int, controllers: int = 1, seed: int = 0) -> bytes:
+
+    header = bytearray(0x100)
+    struct.pack_into('<4s6s?B', header, 0, b'DTM\x1a', b'GALE01', False, (1 << controllers) - 1)
+    struct.pack_into('<QQ', header, 0x15, frames, frames)
+    return bytes(header) + _inputs(frames, 8 * controllers, seed)
+
+MOVIES = {
+    'r08': r08,
+    'r16m': r16m,
+    'rgen': rgen,
+    'm64': m64,
+    'dtm': dtm,
+}
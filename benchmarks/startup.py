@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import json
+import argparse
+import tempfile
+import multiprocessing as mp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import worker
+
+#Time allowed between pressing Run and the replay process being able to latch
+BUDGET = 0.05
+
+def _probe(path: str, t0: float) -> None:
+
+    #Stand-in for hook.main: make sure the replay imports are available and report back
+    import tastm32, hook
+    elapsed = time.perf_counter() - t0
+    with open(path, 'w') as f:
+        f.write(repr(elapsed))
+
+def _collect(path: str) -> float:
+
+    with open(path) as f:
+        elapsed = float(f.read())
+    os.remove(path)
+    return elapsed
+
+def cold(ctx) -> float:
+
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    t0 = time.perf_counter()
+    p = ctx.Process(target = _probe, args = (path, t0))
+    p.start()
+    p.join()
+    return _collect(path)
+
+def warm(pool: worker.WorkerPool) -> float:
+
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    w = pool.acquire()
+    t0 = time.perf_counter()
+    w.start(_probe, path = path, t0 = t0)
+    w.join()
+    return _collect(path)
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure time from Run to a ready replay process')
+    parser.add_argument('--repeat', help='Number of samples per mode', type=int, default=5)
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    args = parser.parse_args()
+
+    spawn = mp.get_context('spawn')
+    pool = worker.WorkerPool()
+    try:
+        results = {
+            'cold spawn': [cold(spawn) for _ in range(args.repeat)],
+            'warm worker': [warm(pool) for _ in range(args.repeat)],
+        }
+    finally:
+        pool.close()
+
+    for name, samples in results.items():
+        best = min(samples)
+        status = 'ok' if best <= BUDGET else 'over budget'
+        print(f'{name}: best {best * 1000:.2f} ms, worst {max(samples) * 1000:.2f} ms ({status})')
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'budget': BUDGET, 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
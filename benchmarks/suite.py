@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import json
+import argparse
+import platform
+import subprocess
+import tracemalloc
+import contextlib
+import multiprocessing as mp
+
+from typing import Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import movies
+
+SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+QUICK_SIZES = [10_000, 100_000]
+
+#Decoder arguments matching what tastm32.main passes for a typical run
+DECODERS = {
+    'r08': {'players': [1, 5]},
+    'r16m': {'players': [1, 2, 3, 4, 5, 6, 7, 8]},
+    'rgen': {'players': [1, 5]},
+    'm64': {},
+    'dtm': {},
+}
+
+class FakeSerial:
+    '''
+    Stands in for the TAStm32 serial port. Every poll reports either one latch or
+    one bulk request for run A and every write is counted and dropped.
+    '''
+
+    def __init__(self, request: bytes) -> None:
+
+        self.request = request
+        self.written = 0
+        self.writes = 0
+
+    def read(self, count: int) -> bytes:
+
+        return self.request
+
+    def inWaiting(self) -> int:
+
+        return 0
+
+    def write(self, data: bytes) -> int:
+
+        self.written += len(data)
+        self.writes += 1
+        return len(data)
+
+def peak_rss() -> int:
+
+    #Peak resident set size of this process in bytes
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == 'darwin' else rss * 1024
+    except ImportError:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss)
+
+def bench_decoder(name: str, frames: int) -> dict:
+
+    module = __import__(name)
+    data = movies.MOVIES[name](frames)
+    t0 = time.perf_counter()
+    out = module.read_input(data, **DECODERS[name])
+    elapsed = time.perf_counter() - t0
+    del out
+    tracemalloc.start()
+    out = module.read_input(data, **DECODERS[name])
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': elapsed, 'frames/s': frames / elapsed, 'retained bytes': size, 'peak alloc bytes': peak}
+
+def bench_main_loop(mode: str, frames: int) -> dict:
+
+    import tastm32
+    buffer = [b'\x00\x00'] * frames
+    results = {}
+    for traced in (False, True):
+        dev = tastm32.TAStm32.from_serial(FakeSerial(b'A' if mode == 'latch' else b'a'))
+        dev.activeRuns[b'A'] = True
+        run = tastm32.RunObject(b'A', buffer, 0, b'\x00\x00')
+        if traced:
+            tracemalloc.start()
+        t0 = time.perf_counter()
+        with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null):
+            dev.main_loop(run)
+        elapsed = time.perf_counter() - t0
+        if traced:
+            size, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results['peak alloc bytes'] = peak
+        else:
+            results.update({'seconds': elapsed, 'frames/s': frames / elapsed, 'writes': dev.ser.writes})
+    return results
+
+def _child(kind: str, name: str, frames: int, conn) -> None:
+
+    if kind == 'decode':
+        result = bench_decoder(name, frames)
+    else:
+        result = bench_main_loop(name, frames)
+    result['peak rss bytes'] = peak_rss()
+    conn.send(result)
+    conn.close()
+
+def measure(kind: str, name: str, frames: int) -> Optional[dict]:
+
+    #Every case gets a fresh process so peak RSS belongs to that case alone.
+    #None if the case crashed; its traceback is already on stderr
+    ctx = mp.get_context('spawn')
+    parent, child = ctx.Pipe()
+    p = ctx.Process(target = _child, args = (kind, name, frames, child))
+    p.start()
+    #Only the child's copy may stay open, so its exit ends the recv below
+    child.close()
+    try:
+        result = parent.recv()
+    except EOFError:
+        result = None
+    p.join()
+    parent.close()
+    if result == None:
+        print(f'{kind} {name} {frames:>10} frames: FAILED with exit code {p.exitcode}')
+        return None
+    result.update({'benchmark': f'{kind} {name}', 'frames': frames})
+    return result
+
+def revision() -> str:
+
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                       cwd = ROOT, stderr = subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def compare(results: list, baseline: dict) -> None:
+
+    old = {(r['benchmark'], r['frames']): r for r in baseline['results']}
+    print(f"Compared with {baseline.get('revision', 'unknown')}:")
+    for r in results:
+        b = old.get((r['benchmark'], r['frames']))
+        if b == None:
+            continue
+        speed = r['frames/s'] / b['frames/s']
+        rss = r['peak rss bytes'] / b['peak rss bytes']
+        print(f"  {r['benchmark']:<16} {r['frames']:>10}: {speed:6.2f}x speed, {rss:6.2f}x peak RSS")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the movie decoders and the replay loop')
+    parser.add_argument('--sizes', help='Comma separated list of movie lengths in frames')
+    parser.add_argument('--quick', help='Only run the small movie sizes', action='store_true')
+    parser.add_argument('--only', help='Comma separated list of benchmarks, e.g. r08,m64,bulk')
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    parser.add_argument('--compare', help='Compare against results from an earlier --output')
+    args = parser.parse_args()
+
+    if args.sizes:
+        sizes = [int(x) for x in args.sizes.split(',')]
+    else:
+        sizes = QUICK_SIZES if args.quick else SIZES
+    cases = [('decode', name) for name in DECODERS] + [('main_loop', 'latch'), ('main_loop', 'bulk')]
+    if args.only:
+        only = args.only.split(',')
+        cases = [case for case in cases if case[1] in only]
+
+    results = []
+    failed = 0
+    for kind, name in cases:
+        for frames in sizes:
+            r = measure(kind, name, frames)
+            if r == None:
+                failed += 1
+                continue
+            results.append(r)
+            print(f"{r['benchmark']:<16} {frames:>10} frames: {r['frames/s']:>14,.0f} frames/s, "
+                  f"peak alloc {r['peak alloc bytes'] / 2**20:8.1f} MiB, peak RSS {r['peak rss bytes'] / 2**20:8.1f} MiB")
+
+    report = {'revision': revision(), 'python': platform.python_version(),
+              'platform': platform.platform(), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    if failed:
+        print(f'{failed} benchmarks failed')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
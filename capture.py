@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+import io
+import os
+import sys
+import json
+import mmap
+import time
+import struct
+import pathlib
+import zipfile
+import threading
+import contextlib
+
+from collections import deque
+from typing import Iterator, Optional
+
+import argparse_helper
+
+# Capture log layout:
+#   header       magic, version, wall clock time of the first record in ns,
+#                end of the last record
+#   records      time since the first record in ns, kind, length, payload
+# The file is preallocated and records are only ever appended, so the end
+# offset in the header tells where the valid records stop.
+MAGIC = b'TSCP'
+VERSION = 1
+header_struct = struct.Struct('<4sHxxQQ')
+record_struct = struct.Struct('<QcxxxI')
+
+SENT = b'S'
+RECEIVED = b'R'
+MARK = b'M'
+
+DEFAULT_SIZE = 64 * 1024 * 1024
+
+class CaptureLog:
+    '''
+    Binary log of every byte sent to and received from the TAStm32.
+
+    record() only timestamps the data and appends it to a queue, so it can be
+    called from main_loop for every packet. A background thread writes the
+    queue into the preallocated file.
+    '''
+
+    def __init__(self, path: str, size: int = DEFAULT_SIZE, interval: float = 0.05) -> None:
+
+        self.path = path
+        self.size = size
+        self.interval = interval
+        self.file = open(path, 'w+b')
+        self._allocate(size)
+        self.origin = time.perf_counter_ns()
+        self.file.write(header_struct.pack(MAGIC, VERSION, time.time_ns(), header_struct.size))
+        self.end = header_struct.size
+        self.queue = deque()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target = self._drain, daemon = True)
+        self.thread.start()
+
+    def _allocate(self, size: int) -> None:
+
+        #Reserve the file's space up front so appending never has to grow it
+        self.file.truncate(size)
+        if hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(self.file.fileno(), 0, size)
+            except OSError:
+                pass
+
+    def record(self, kind: bytes, data: bytes) -> None:
+
+        self.queue.append((time.perf_counter_ns(), kind, data))
+
+    def mark(self, name: str, **values) -> None:
+
+        values['name'] = name
+        self.record(MARK, json.dumps(values).encode())
+
+    def _write(self) -> None:
+
+        queue = self.queue
+        while queue:
+            ns, kind, data = queue.popleft()
+            size = record_struct.size + len(data)
+            if self.end + size > self.size:
+                self.size = max(self.size * 2, self.end + size)
+                self._allocate(self.size)
+            self.file.write(record_struct.pack(ns - self.origin, kind, len(data)))
+            self.file.write(data)
+            self.end += size
+
+    def _drain(self) -> None:
+
+        while not self.stopping.wait(self.interval):
+            self._write()
+        self._write()
+
+    def close(self) -> None:
+
+        if self.file.closed:
+            return
+        self.stopping.set()
+        self.thread.join()
+        self.file.seek(0)
+        header = bytearray(self.file.read(header_struct.size))
+        header_struct.pack_into(header, 0, MAGIC, VERSION, header_struct.unpack(header)[2], self.end)
+        self.file.seek(0)
+        self.file.write(header)
+        self.file.truncate(self.end)
+        self.file.close()
+
+def read_capture(path: str) -> Iterator[tuple]:
+
+    #(ns since the first record, kind, payload) of every record in a capture log
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as m:
+            magic, version, wall, end = header_struct.unpack_from(m, 0)
+            if magic != MAGIC:
+                raise RuntimeError('Not a capture log')
+            if version != VERSION:
+                raise RuntimeError('Unsupported capture log version {}'.format(version))
+            if end == header_struct.size and len(m) > end:
+                #Never closed, so read records until the zeroed preallocated space
+                end = len(m)
+            offset = header_struct.size
+            while offset + record_struct.size <= end:
+                ns, kind, length = record_struct.unpack_from(m, offset)
+                if kind == b'\x00':
+                    break
+                offset += record_struct.size
+                yield ns, kind, m[offset:offset + length]
+                offset += length
+
+def marks(path: str) -> dict:
+
+    #The values of every mark in a capture log by name
+    return {values['name']: values for values in (json.loads(data) for ns, kind, data in read_capture(path)
+                                                  if kind == MARK)}
+
+def describe(kind: bytes, data: bytes, run_id: Optional[bytes] = None) -> str:
+
+    #What a record means to main_loop
+    if kind == MARK:
+        return data.decode()
+    notes = []
+    if kind == RECEIVED and run_id != None:
+        for code, label in ((run_id, 'latches'), (run_id.lower(), 'bulk requests'), (b'\xB0', 'overflows'),
+                            (b'UA', 'train skips'), (b'UB', 'train extras'), (b'UC', 'train successes'),
+                            (b'UF', 'train failures')):
+            count = data.count(code)
+            if count != 0:
+                notes.append(f'{count} {label}')
+    text = data.hex() if len(data) <= 32 else f'{data[:32].hex()}... ({len(data)} bytes)'
+    return text + (f'  [{", ".join(notes)}]' if notes else '')
+
+class ReplaySerial:
+    '''
+    Stands in for the TAStm32 serial port by handing back what the device sent
+    in a capture. Bytes the device sent without the host writing anything in
+    between arrive together, as they would have waited in the port.
+    '''
+
+    def __init__(self, chunks: list) -> None:
+
+        self.chunks = deque(chunks)
+        self.pending = b''
+        self.written = bytearray()
+
+    def read(self, count: int) -> bytes:
+
+        if self.pending == b'':
+            if not self.chunks:
+                #main_loop stops cleanly on ^C
+                raise KeyboardInterrupt
+            self.pending = self.chunks.popleft()
+        data = self.pending[:count]
+        self.pending = self.pending[count:]
+        return data
+
+    def inWaiting(self) -> int:
+
+        return len(self.pending)
+
+    def write(self, data: bytes) -> int:
+
+        self.written += data
+        return len(data)
+
+    def close(self) -> None:
+
+        pass
+
+def load_run(path: str, console: str, players: list, start: int = 0) -> tuple:
+
+    #RunObject arguments for the movie, .tas file or compiled stream at path:
+    #(frames, blank frame, ring or None)
+    import tascompile
+    from tastm32 import decode_movie
+    if tascompile.is_stream(path):
+        stream = tascompile.CompiledStream(path)
+        return stream, stream.blank[len(stream.prefix):], stream
+    if pathlib.Path(path).suffix.lower() in ('.tas', '.zip'):
+        with zipfile.ZipFile(path) as z:
+            with z.open('run.json') as j:
+                run = json.load(j)
+            with z.open(run['movie']) as m:
+                data = m.read()
+    else:
+        with open(path, 'rb') as f:
+            data = f.read()
+    buffer, blankframe = decode_movie(console, data, players, jobs = 1)
+    return buffer[start:], blankframe, None
+
+def replay(path: str, movie: Optional[str] = None, quiet: bool = True) -> tuple:
+    '''
+    Run main_loop again against what the device sent in a capture and compare
+    what it writes with what was written during the capture. The device is
+    made with TAStm32.from_serial on a serial port that plays back the
+    captured reads, so it starts in the same state as a freshly opened one.
+    Returns (bytes written now, bytes written then).
+    '''
+
+    from tastm32 import TAStm32, RunObject
+    found = marks(path)
+    if 'run' not in found or 'main loop' not in found:
+        raise RuntimeError('Capture does not contain a main loop')
+    run = found['run']
+    loop = found['main loop']
+    if movie == None:
+        movie = run.get('movie')
+    if movie == None:
+        raise RuntimeError('Capture does not name its movie; pass it with --movie')
+    frames, blankframe, ring = load_run(movie, run['console'], run['players'], run.get('start', 0))
+
+    #Everything from the main loop mark on, with consecutive reads merged
+    chunks = []
+    sent = bytearray()
+    looping = False
+    last = None
+    for ns, kind, data in read_capture(path):
+        if kind == MARK:
+            looping = looping or json.loads(data)['name'] == 'main loop'
+            continue
+        if not looping:
+            continue
+        if kind == RECEIVED:
+            if last == RECEIVED:
+                chunks[-1] += data
+            else:
+                chunks.append(bytes(data))
+        else:
+            sent += data
+        last = kind
+
+    run_id = loop['run_id'].encode()
+    run_object = RunObject(run_id, frames, loop['fn'], blankframe, ring = ring, buffered = loop.get('buffered'))
+    dev = TAStm32.from_serial(ReplaySerial(chunks))
+    dev.activeRuns[run_id] = True
+    out = io.StringIO() if quiet else sys.stdout
+    with contextlib.redirect_stdout(out):
+        try:
+            dev.main_loop(run_object)
+        except SystemExit:
+            #A failed latch train ends the loop the same way it did live
+            pass
+    return bytes(dev.ser.written), bytes(sent)
+
+def main():
+    parser = argparse_helper.capture_parser()
+    args = parser.parse_args()
+
+    if args.replay:
+        now, then = replay(args.capture, args.movie)
+        if now == then:
+            print(f'Replay matches the capture: {len(then)} bytes sent')
+            sys.exit(0)
+        common = min(len(now), len(then))
+        first = next((i for i in range(common) if now[i] != then[i]), common)
+        print(f'Replay differs from the capture at byte {first} of {len(then)} sent ({len(now)} sent now)')
+        print(f'  capture: {then[first:first + 32].hex()}')
+        print(f'  replay:  {now[first:first + 32].hex()}')
+        sys.exit(1)
+
+    run_id = None
+    shown = 0
+    for ns, kind, data in read_capture(args.capture):
+        if kind == MARK:
+            values = json.loads(data)
+            if 'run_id' in values:
+                run_id = values['run_id'].encode()
+        if shown < args.limit:
+            print(f'{ns / 1e6:12.3f} ms {kind.decode()} {describe(kind, data, run_id)}')
+            shown += 1
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+import sys
+import zlib
+import struct
+import shutil
+import tempfile
+import threading
+
+from collections import OrderedDict
+from typing import Iterator, Optional
+
+import consoles
+
+# Chunked movie layout:
+#   header       magic, version, frame stride, movie header size, frames per block,
+#                raw movie size, block count
+#   prologue     the movie's own header bytes, uncompressed
+#   index        block count + 1 offsets of the compressed blocks
+#   blocks       zlib-compressed runs of frames_per_block frames each
+# Any bytes after the last whole frame go into the last block, so unpacking
+# always gives back the original file.
+MAGIC = b'TSCK'
+VERSION = 1
+header_struct = struct.Struct('<4sHHIIQI')
+
+BLOCK_FRAMES = 4096
+
+def layout(console: str, data: bytes) -> tuple:
+
+    #Size of the movie header and of one frame in the raw movie file
+    start, stride, controllers = consoles.get(console).layout(data)
+    return start, stride
+
+def is_chunked(data: bytes) -> bool:
+
+    return data[:len(MAGIC)] == MAGIC
+
+def pack(data: bytes, start: int, stride: int, block_frames: int = BLOCK_FRAMES, level: int = 6) -> bytes:
+
+    block_size = block_frames * stride
+    body = memoryview(data)[start:]
+    count = max(1, -(-(len(body) // stride) // block_frames))
+    blocks = []
+    for i in range(count):
+        end = (i + 1) * block_size if i < count - 1 else len(body)
+        blocks.append(zlib.compress(body[i * block_size:end], level))
+    offsets = [0]
+    for block in blocks:
+        offsets.append(offsets[-1] + len(block))
+    header = header_struct.pack(MAGIC, VERSION, stride, start, block_frames, len(data), count)
+    index = struct.pack(f'<{count + 1}Q', *offsets)
+    return b''.join([header, data[:start], index, *blocks])
+
+def pack_file(src, dst, size: int, start: int, stride: int, block_frames: int = BLOCK_FRAMES,
+              level: int = 6, digest = None) -> int:
+
+    #Same bytes as pack() from a file object of size bytes into dst, holding one
+    #raw block at a time. The compressed blocks wait in a temporary file until
+    #the index in front of them is known. digest is updated with the raw bytes
+    block_size = block_frames * stride
+    count = max(1, -(-((size - start) // stride) // block_frames))
+    prologue = src.read(start)
+    if digest != None:
+        digest.update(prologue)
+    offsets = [0]
+    with tempfile.SpooledTemporaryFile(1 << 26) as spool:
+        for i in range(count):
+            raw = src.read(block_size if i < count - 1 else size - start - i * block_size)
+            if digest != None:
+                digest.update(raw)
+            offsets.append(offsets[-1] + spool.write(zlib.compress(raw, level)))
+        dst.write(header_struct.pack(MAGIC, VERSION, stride, start, block_frames, size, count))
+        dst.write(prologue)
+        dst.write(struct.pack(f'<{count + 1}Q', *offsets))
+        spool.seek(0)
+        shutil.copyfileobj(spool, dst, 1 << 20)
+    return header_struct.size + start + 8 * (count + 1) + offsets[-1]
+
+class ChunkedMovie:
+    '''
+    Random access to a chunked movie. Only the blocks that are asked for get
+    decompressed, and a few recently used ones are kept around.
+    '''
+
+    def __init__(self, data: bytes, cache: int = 4) -> None:
+
+        (magic, version, self.stride, self.start, self.block_frames,
+         self.size, self.count) = header_struct.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise RuntimeError('Bad chunked movie magic')
+        if version != VERSION:
+            raise RuntimeError('Unsupported chunked movie version {}'.format(version))
+        self.data = memoryview(data)
+        offset = header_struct.size
+        self.header = self.data[offset:offset + self.start].tobytes()
+        offset += self.start
+        self.offsets = struct.unpack_from(f'<{self.count + 1}Q', data, offset)
+        self.base = offset + 8 * (self.count + 1)
+        self.frame_count = (self.size - self.start) // self.stride
+        self.cache: OrderedDict = OrderedDict()
+        self.cache_size = cache
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+
+        return self.frame_count
+
+    def block(self, index: int) -> bytes:
+
+        with self.lock:
+            if index in self.cache:
+                self.cache.move_to_end(index)
+                return self.cache[index]
+        raw = zlib.decompress(self.data[self.base + self.offsets[index]:self.base + self.offsets[index + 1]])
+        with self.lock:
+            self.cache[index] = raw
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last = False)
+        return raw
+
+    def frames(self, start: int, stop: int) -> bytes:
+
+        #Raw movie bytes of frames start .. stop - 1, touching only the blocks they live in
+        stop = min(stop, self.frame_count)
+        if start >= stop:
+            return b''
+        first = start // self.block_frames
+        last = (stop - 1) // self.block_frames
+        out = []
+        for index in range(first, last + 1):
+            raw = self.block(index)
+            base = index * self.block_frames
+            lo = max(start, base) - base
+            hi = min(stop, base + self.block_frames) - base
+            out.append(raw[lo * self.stride:hi * self.stride])
+        return b''.join(out)
+
+    def iter_frames(self, start: int = 0) -> Iterator[bytes]:
+
+        #Raw bytes one block at a time from frame start onwards, for streaming
+        #decompression ahead of the replay
+        while start < self.frame_count:
+            stop = (start // self.block_frames + 1) * self.block_frames
+            yield self.frames(start, stop)
+            start = stop
+
+    def tobytes(self, start: Optional[int] = None) -> bytes:
+
+        #The original movie file, or one that begins at frame start
+        if start == None:
+            return b''.join([self.header, *[zlib.decompress(self.data[self.base + self.offsets[i]:self.base + self.offsets[i + 1]])
+                                            for i in range(self.count)]])
+        return b''.join([self.header, *self.iter_frames(start)])
+
+def unpack(data: bytes) -> bytes:
+
+    #Raw movie bytes whether or not data is chunked
+    if is_chunked(data):
+        return ChunkedMovie(data).tobytes()
+    return data
+
+def main():
+    try:
+        file = sys.argv[1]
+    except:
+        print(f'Usage {sys.argv[0]} <chunked movie>')
+        sys.exit()
+    with open(file, 'rb') as f:
+        movie = ChunkedMovie(f.read())
+    print(f'Frames: {len(movie)}, stride: {movie.stride}, blocks: {movie.count} of {movie.block_frames} frames')
+    print(f'Compressed {movie.base + movie.offsets[-1]} bytes, raw {movie.size} bytes')
+
+if __name__ == '__main__':
+    main()
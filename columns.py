@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+from framebuffer import FrameBuffer
+
+def gather_map(ports: tuple, field_size: int, players: list) -> list:
+    '''
+    Byte offsets within one input frame of every byte to keep, in port order.
+
+    ports lists the player number of each field of the input frame, e.g.
+    (1, 5) for the two ports of an r08 frame. The players list is looked at
+    once here instead of once per field of every frame.
+    '''
+
+    wanted = {int(p) for p in players}
+    offsets = []
+    for field, player in enumerate(ports):
+        if player in wanted:
+            offsets.extend(range(field * field_size, (field + 1) * field_size))
+    return offsets
+
+def select(data: bytes, in_stride: int, offsets: list) -> FrameBuffer:
+
+    #Gather the bytes at offsets out of every in_stride byte frame of data
+    view = memoryview(data).cast('B')
+    count = len(view) // in_stride
+    view = view[:count * in_stride]
+    if offsets == list(range(in_stride)):
+        #Every byte is kept, so the input already is the output
+        return FrameBuffer(view, in_stride)
+    out_stride = len(offsets)
+    if out_stride == 0:
+        raise RuntimeError('No players selected')
+    out = bytearray(count * out_stride)
+    for column, offset in enumerate(offsets):
+        out[column::out_stride] = view[offset::in_stride]
+    return FrameBuffer(out, out_stride)
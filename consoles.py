@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+import struct
+import importlib
+
+from typing import Optional
+
+class ConsoleFormat:
+    '''
+    Everything the replay code needs to know about one console: which module
+    decodes its movies, how the raw movie file is laid out, how big a frame is
+    per player, which players the TAStm32 supports and which setup byte it is
+    configured with.
+
+    The decoder module is only imported the first time a movie is decoded.
+    '''
+
+    __slots__ = ('name', 'label', 'run_name', 'cbyte', 'module', 'extension', 'frame_size', 'players',
+                 'header_size', 'controllers', 'header_layout', 'settings', 'takes_players', 'takes_header',
+                 'buttons', 'signed_axes', '_module')
+
+    def __init__(self, name: str, label: str, cbyte: bytes, module: str, frame_size: int, players: tuple, *,
+                 run_name: Optional[str] = None, header_size: int = 0, controllers: int = 1,
+                 header_layout = None, settings: bool = False, takes_players: bool = True,
+                 takes_header: bool = False, buttons: Optional[tuple] = None,
+                 signed_axes: bool = False) -> None:
+
+        self.name = name
+        self.label = label
+        #Console name as tasfile.py writes it into run.json
+        self.run_name = run_name if run_name != None else label
+        self.cbyte = cbyte
+        self.module = module
+        self.extension = module
+        self.frame_size = frame_size
+        self.players = players
+        #Bytes of movie header and controllers stored per frame. Formats whose
+        #header says both pass header_layout, a function of the header bytes
+        #returning (header size, controllers); header_size is then the most
+        #header bytes it may need
+        self.header_size = header_size
+        self.controllers = controllers
+        self.header_layout = header_layout
+        self.settings = settings
+        self.takes_players = takes_players
+        self.takes_header = takes_header
+        #Meaning of each byte of one player's decoded frame: 8 button names from the
+        #most significant bit down ('' for unused bits), or the name of an analog axis
+        if buttons == None:
+            buttons = tuple(tuple(f'Bit {8 * i + b}' for b in range(7, -1, -1)) for i in range(frame_size))
+        self.buttons = buttons
+        self.signed_axes = signed_axes
+        self._module = None
+
+    def decoder(self):
+
+        if self._module == None:
+            self._module = importlib.import_module(self.module)
+        return self._module.read_input
+
+    def layout(self, data: bytes) -> tuple:
+
+        #Header size, bytes per frame and controllers of a raw movie starting with data
+        if self.header_layout == None:
+            start, controllers = self.header_size, self.controllers
+        else:
+            start, controllers = self.header_layout(data)
+        controllers = max(controllers, 1)
+        return start, self.frame_size * controllers, controllers
+
+    def decode(self, data: bytes, players: list, header: Optional[dict] = None):
+
+        kwargs = {}
+        if self.takes_header:
+            kwargs['header'] = header
+        if self.takes_players:
+            kwargs['players'] = players
+        return self.decoder()(data, **kwargs)
+
+    def pressed(self, frame: bytes) -> list:
+
+        #Button names and analog values of one player's frame
+        out = []
+        for value, names in zip(frame, self.buttons):
+            if isinstance(names, str):
+                if self.signed_axes and value > 127:
+                    value -= 256
+                out.append(f'{names} {value}')
+            else:
+                out.extend(name for bit, name in enumerate(names) if name and value & (0x80 >> bit))
+        return out
+
+    def blankframe(self, players: list) -> bytes:
+
+        return b'\x00' * self.frame_size * len(players)
+
+    def setup_bytes(self, players: list, dpcm: bool = False, overread: bool = False, clock_filter: int = 0) -> tuple:
+
+        pbyte = 0
+        for player in players:
+            p = int(player)
+            if p in self.players:
+                pbyte = pbyte ^ 2**(8-p)
+            else:
+                raise RuntimeError('Invalid player for {}'.format(self.label))
+        sbyte = 0
+        if self.settings:
+            if dpcm:
+                sbyte = sbyte ^ 0x80
+            if overread:
+                sbyte = sbyte ^ 0x40
+            if clock_filter:
+                sbyte = sbyte + clock_filter
+        return self.cbyte, pbyte, sbyte
+
+CONSOLES: dict = {}
+ALIASES: dict = {}
+
+def register(console: ConsoleFormat, *aliases: str) -> ConsoleFormat:
+
+    CONSOLES[console.name] = console
+    for alias in aliases:
+        ALIASES[alias] = console.name
+    return console
+
+def get(name: str) -> ConsoleFormat:
+
+    name = name.lower()
+    name = ALIASES.get(name, name)
+    if name not in CONSOLES:
+        raise RuntimeError('Unknown console {}'.format(name))
+    return CONSOLES[name]
+
+def for_extension(extension: str) -> ConsoleFormat:
+
+    extension = extension.lower().lstrip('.')
+    for console in CONSOLES.values():
+        if console.extension == extension:
+            return console
+    raise RuntimeError('No console plays {} movies'.format(extension or 'extensionless'))
+
+def valid_players() -> dict:
+
+    return {name: console.players for name, console in CONSOLES.items()}
+
+def _m64_layout(data: bytes) -> tuple:
+
+    version, = struct.unpack_from('<I', data, 0x4)
+    return (0x200 if version in (1, 2) else 0x400), data[0x15]
+
+def _dtm_layout(data: bytes) -> tuple:
+
+    return 0x100, bin(data[0xB] & 0xf).count('1')
+
+register(ConsoleFormat('n64', 'N64', b'M', 'm64', 4, (1,2,), header_size = 0x400,
+                       header_layout = _m64_layout, takes_header = True,
+                       buttons = (('A', 'B', 'Z', 'Start', 'Up', 'Down', 'Left', 'Right'),
+                                  ('', '', 'L', 'R', 'C-Up', 'C-Down', 'C-Left', 'C-Right'),
+                                  'X', 'Y'),
+                       signed_axes = True))
+register(ConsoleFormat('snes', 'SNES', b'S', 'r16m', 2, (1,2,3,4,5,6,7,8,), controllers = 8, settings = True,
+                       buttons = (('B', 'Y', 'Select', 'Start', 'Up', 'Down', 'Left', 'Right'),
+                                  ('A', 'X', 'L', 'R', '', '', '', ''))))
+register(ConsoleFormat('nes', 'NES', b'N', 'r08', 1, (1,5,), controllers = 2, settings = True,
+                       buttons = (('A', 'B', 'Select', 'Start', 'Up', 'Down', 'Left', 'Right'),)))
+register(ConsoleFormat('gc', 'GC', b'G', 'dtm', 8, (1,), run_name = 'Gamecube',
+                       header_size = 0x100, header_layout = _dtm_layout, takes_players = False, takes_header = True,
+                       buttons = (('', '', '', 'Start', 'Y', 'X', 'B', 'A'),
+                                  ('', 'L', 'R', 'Z', 'Up', 'Down', 'Right', 'Left'),
+                                  'Stick X', 'Stick Y', 'C-Stick X', 'C-Stick Y', 'L Analog', 'R Analog')),
+         'gamecube')
+register(ConsoleFormat('genesis', 'Genesis', b'J', 'rgen', 2, (1,5,), controllers = 2))
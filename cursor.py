@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+from multiprocessing.shared_memory import SharedMemory
+from typing import Optional
+
+class FrameCursor:
+    '''
+    One frame number shared between the replay process and the GUI.
+
+    main_loop stores the next frame it will send after every chunk it handles,
+    the GUI reads it whenever it redraws. Nothing is sent between the
+    processes, so a fast latch rate costs the replay one store per chunk.
+    '''
+
+    IDLE = -1
+
+    def __init__(self, name: Optional[str] = None) -> None:
+
+        if name == None:
+            self.shm = SharedMemory(create = True, size = 8)
+            self.owner = True
+        else:
+            #Only the creator unlinks the block
+            self.shm = SharedMemory(name)
+            self.owner = False
+        self.name = self.shm.name
+        self.view = self.shm.buf.cast('q')
+        if self.owner:
+            self.view[0] = self.IDLE
+
+    def set(self, fn: int) -> None:
+
+        self.view[0] = fn
+
+    def get(self) -> int:
+
+        return self.view[0]
+
+    def close(self) -> None:
+
+        if self.view == None:
+            return
+        self.view.release()
+        self.view = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
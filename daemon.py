@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+import os
+import sys
+import hmac
+import json
+import time
+import pathlib
+import secrets
+import tempfile
+import threading
+import urllib.parse
+import urllib.request
+import urllib.error
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+import argparse_helper
+from cursor import FrameCursor
+from worker import WorkerPool
+
+DEFAULT_PORT = 8732
+
+# hook.main parameters a job may set on top of its .tas file, in hook.main's units
+OVERRIDES = ('controllers', 'clock', 'dpcm', 'overread', 'blank', 'start', 'jobs', 'transitions',
+             'latch_train', 'reset', 'nobulk', 'debug', 'capture', 'cursor', 'metrics_port', 'metrics_file',
+             'trace', 'profile')
+
+# Overrides naming files the replay writes. They must lie in the daemon's log directory
+PATHS = ('capture', 'trace', 'profile', 'metrics_file')
+
+TOKEN_HEADER = 'X-TAStm32-Token'
+
+def _job(log: str, kwargs: dict) -> None:
+
+    #Runs in the replay process: everything it prints goes to the job's log
+    out = open(log, 'a', buffering = 1)
+    sys.stdout = out
+    sys.stderr = out
+    from hook import main
+    main(**kwargs)
+
+class Job:
+
+    def __init__(self, job_id: int, run: str, serial: str, log: str, worker, cursor: FrameCursor) -> None:
+
+        self.id = job_id
+        self.run = run
+        self.serial = serial
+        self.log = log
+        self.worker = worker
+        self.cursor = cursor
+        self.started = time.time()
+        self.stopped = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+
+        if self.worker.is_alive():
+            return 'running'
+        if self.stopped:
+            return 'stopped'
+        return 'finished' if self.worker.process.exitcode == 0 else 'failed'
+
+    def frame(self) -> int:
+
+        with self.lock:
+            return self.cursor.get() if self.cursor.view != None else FrameCursor.IDLE
+
+    def finish(self) -> None:
+
+        #Give back the shared memory of a job whose process has ended
+        with self.lock:
+            if not self.worker.is_alive():
+                self.cursor.close()
+
+    def describe(self) -> dict:
+
+        return {'id': self.id, 'run': self.run, 'serial': self.serial, 'state': self.state,
+                'frame': self.frame(), 'started': self.started, 'log': self.log}
+
+class Daemon:
+    '''
+    Owns the TAStm32 serial ports and runs one replay process per port.
+
+    Replays run in warm worker processes without any GUI. Their output goes to
+    a log file per job, which any number of clients can follow. Every request
+    has to carry the daemon's token, which only the user running it can read.
+    '''
+
+    def __init__(self, ports: list, logs: Optional[str] = None) -> None:
+
+        self.ports = ports
+        self.logs = logs if logs != None else tempfile.mkdtemp(prefix = 'tastm32d-')
+        self.token = secrets.token_urlsafe(32)
+        self.jobs: dict = {}
+        self.next_id = 1
+        #Ports of jobs that are still waiting for a worker
+        self.reserved: set = set()
+        self.lock = threading.Lock()
+        self.pool = WorkerPool()
+
+    def busy(self, serial: str) -> bool:
+
+        if serial in self.reserved:
+            return True
+        return any(job.serial == serial and job.state == 'running' for job in self.jobs.values())
+
+    def confine(self, name: str) -> str:
+
+        #Relative paths are taken from the log directory, nothing may leave it
+        root = pathlib.Path(self.logs).resolve()
+        path = (root / name).resolve()
+        try:
+            path.relative_to(root)
+        except ValueError:
+            raise RuntimeError('{} is outside the log directory {}'.format(name, root))
+        return str(path)
+
+    def reap(self) -> None:
+
+        for job in list(self.jobs.values()):
+            job.finish()
+
+    def submit(self, request: dict) -> Job:
+
+        from sweep import read_run
+        settings, movie = read_run(request['run'])
+        unknown = set(request.get('overrides', {})) - set(OVERRIDES)
+        if unknown:
+            raise RuntimeError('Unknown overrides {}'.format(', '.join(sorted(unknown))))
+        settings.update(request.get('overrides', {}))
+        for name in PATHS:
+            if settings.get(name) != None:
+                settings[name] = self.confine(settings[name])
+        if settings.get('clock') != None:
+            #Quarter microseconds as read_run gives them, not the run's microseconds
+            clock = settings['clock']
+            if not isinstance(clock, int) or clock < 0 or clock > 63:
+                raise RuntimeError('clock must be a whole number of quarter microseconds from 0 to 63')
+        if isinstance(settings['transitions'], str):
+            split = settings['transitions'].split(' ') if settings['transitions'] != '' else []
+            settings['transitions'] = [[int(split[i]), split[i + 1]] for i in range(0, len(split) - 1, 2)]
+        with self.lock:
+            serial = request.get('serial')
+            if serial == None:
+                serial = next((port for port in self.ports if not self.busy(port)), None)
+                if serial == None:
+                    raise RuntimeError('Every port is busy')
+            elif serial not in self.ports:
+                raise RuntimeError('Port {} is not owned by this daemon'.format(serial))
+            elif self.busy(serial):
+                raise RuntimeError('Port {} is busy'.format(serial))
+            self.reserved.add(serial)
+            job_id = self.next_id
+            self.next_id += 1
+        #Waiting for a worker can take a while; other requests go on meanwhile
+        try:
+            log = os.path.join(self.logs, f'{job_id}.log')
+            #The daemon reads the frame of its own cursor, a client may pass its own to watch
+            cursor = FrameCursor(settings.get('cursor'))
+            kwargs = dict(settings, movie = movie, serial = serial, cursor = cursor.name)
+            kwargs.setdefault('debug', False)
+            kwargs['requested'] = time.time()
+            worker = self.pool.acquire()
+            worker.start(_job, log = log, kwargs = kwargs)
+            job = Job(job_id, request['run'], serial, log, worker, cursor)
+            with self.lock:
+                self.jobs[job_id] = job
+        finally:
+            with self.lock:
+                self.reserved.discard(serial)
+        return job
+
+    def stop(self, job_id: int) -> Job:
+
+        job = self.jobs[job_id]
+        if job.worker.is_alive():
+            job.stopped = True
+            job.worker.terminate()
+            job.worker.join(1.0)
+        return job
+
+    def close(self) -> None:
+
+        for job in self.jobs.values():
+            if job.worker.is_alive():
+                job.worker.terminate()
+                job.worker.join(1.0)
+            job.cursor.close()
+        self.pool.close()
+
+class Handler(BaseHTTPRequestHandler):
+
+    daemon: Daemon = None
+
+    def send_json(self, value, status: int = 200) -> None:
+
+        body = json.dumps(value).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def allowed(self) -> bool:
+
+        #Web pages can reach 127.0.0.1 too. Refuse anything a browser sends for
+        #another site, names other than this machine and requests without the token
+        port = self.server.server_address[1]
+        hosts = ('127.0.0.1', 'localhost', f'127.0.0.1:{port}', f'localhost:{port}')
+        origin = self.headers.get('Origin')
+        if self.headers.get('Host') not in hosts:
+            self.send_json({'error': 'Unknown host'}, 403)
+        elif origin != None and origin not in (f'http://127.0.0.1:{port}', f'http://localhost:{port}'):
+            self.send_json({'error': 'Cross-origin requests are not allowed'}, 403)
+        elif not hmac.compare_digest(self.headers.get(TOKEN_HEADER, '').encode('latin-1'), self.daemon.token.encode()):
+            self.send_json({'error': 'Missing or wrong token'}, 401)
+        else:
+            self.daemon.reap()
+            return True
+        return False
+
+    def job(self, text: str) -> Optional[Job]:
+
+        job = self.daemon.jobs.get(int(text)) if text.isnumeric() else None
+        if job == None:
+            self.send_json({'error': 'No such job'}, 404)
+        return job
+
+    def do_GET(self) -> None:
+
+        if not self.allowed():
+            return
+        parts = [part for part in self.path.split('/') if part != '']
+        if parts == ['ports']:
+            self.send_json([{'serial': port, 'busy': self.daemon.busy(port)} for port in self.daemon.ports])
+        elif parts == ['jobs']:
+            self.send_json([job.describe() for job in self.daemon.jobs.values()])
+        elif len(parts) == 2 and parts[0] == 'jobs':
+            job = self.job(parts[1])
+            if job != None:
+                self.send_json(job.describe())
+        elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'telemetry':
+            job = self.job(parts[1])
+            if job != None:
+                self.stream(job)
+        else:
+            self.send_json({'error': 'Not found'}, 404)
+
+    def do_POST(self) -> None:
+
+        if not self.allowed():
+            return
+        if self.headers.get_content_type() != 'application/json':
+            self.send_json({'error': 'Requests must be application/json'}, 415)
+            return
+        parts = [part for part in self.path.split('/') if part != '']
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+            if parts == ['jobs']:
+                self.send_json(self.daemon.submit(request).describe(), 201)
+            elif len(parts) == 3 and parts[0] == 'jobs' and parts[2] == 'stop':
+                job = self.job(parts[1])
+                if job != None:
+                    self.send_json(self.daemon.stop(job.id).describe())
+            else:
+                self.send_json({'error': 'Not found'}, 404)
+        except (RuntimeError, KeyError, ValueError, OSError) as e:
+            self.send_json({'error': str(e)}, 400)
+
+    def stream(self, job: Job, interval: float = 0.2) -> None:
+
+        #One JSON line per interval with the job state and its new output,
+        #until the job ends or the client goes away
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        offset = 0
+        while True:
+            state = job.state
+            lines = []
+            if os.path.exists(job.log):
+                with open(job.log, 'r') as f:
+                    f.seek(offset)
+                    text = f.read()
+                #Only whole lines; the rest is picked up next time
+                end = text.rfind('\n') + 1
+                lines = text[:end].splitlines()
+                offset += len(text[:end].encode())
+            try:
+                update = {'state': state, 'frame': job.frame(), 'output': lines}
+                self.wfile.write((json.dumps(update) + '\n').encode())
+                self.wfile.flush()
+            except OSError:
+                return
+            if state != 'running':
+                return
+            time.sleep(interval)
+
+    def log_message(self, format: str, *args) -> None:
+
+        pass
+
+def token_path(port: int) -> pathlib.Path:
+
+    return pathlib.Path.home() / f'.tastm32d-{port}.token'
+
+def read_token(url: str) -> str:
+
+    #The token the daemon at url left for clients run by the same user
+    port = urllib.parse.urlsplit(url).port or DEFAULT_PORT
+    try:
+        return token_path(port).read_text().strip()
+    except FileNotFoundError:
+        raise RuntimeError('No token in {}, is the daemon running as this user?'.format(token_path(port)))
+
+def serve(ports: list, port: int = DEFAULT_PORT, logs: Optional[str] = None) -> None:
+
+    daemon = Daemon(ports, logs)
+    Handler.daemon = daemon
+    #Only reachable from this machine
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    server.daemon_threads = True
+    token = token_path(port)
+    fd = os.open(token, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write(daemon.token)
+    os.chmod(token, 0o600)
+    print(f'Serving {", ".join(ports)} on http://127.0.0.1:{port}, logs in {daemon.logs}, token in {token}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        daemon.close()
+        token.unlink(missing_ok = True)
+
+def request(url: str, path: str, body: Optional[dict] = None):
+
+    #JSON request to a running daemon
+    data = json.dumps(body).encode() if body != None else None
+    req = urllib.request.Request(url.rstrip('/') + path, data = data,
+                                 headers = {'Content-Type': 'application/json', TOKEN_HEADER: read_token(url)})
+    try:
+        with urllib.request.urlopen(req) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        raise RuntimeError(json.load(e).get('error', str(e)))
+
+def watch(url: str, job_id: int):
+
+    #Yields the telemetry lines of a job as dicts until it ends
+    req = urllib.request.Request(f'{url.rstrip("/")}/jobs/{job_id}/telemetry',
+                                 headers = {TOKEN_HEADER: read_token(url)})
+    with urllib.request.urlopen(req) as response:
+        for line in response:
+            yield json.loads(line)
+
+class RemoteJob:
+    '''
+    A job of a daemon seen from a client, with the is_alive()/terminate()
+    of a local replay process. The state is asked for at most once a second.
+    '''
+
+    def __init__(self, url: str, job: dict) -> None:
+
+        self.url = url
+        self.id = job['id']
+        self.state = job['state']
+        self.checked = time.monotonic()
+
+    def is_alive(self) -> bool:
+
+        if self.state == 'running' and time.monotonic() - self.checked > 1.0:
+            try:
+                self.state = request(self.url, f'/jobs/{self.id}')['state']
+            except (RuntimeError, OSError):
+                self.state = 'unreachable'
+            self.checked = time.monotonic()
+        return self.state == 'running'
+
+    def terminate(self) -> None:
+
+        self.state = request(self.url, f'/jobs/{self.id}/stop', {})['state']
+
+def main():
+    parser = argparse_helper.daemon_parser()
+    args = parser.parse_args()
+    url = f'http://127.0.0.1:{args.port}'
+
+    if args.command == 'serve':
+        serve(args.serial, args.port, args.logs)
+        return
+    try:
+        if args.command == 'run':
+            overrides = json.loads(args.overrides) if args.overrides != None else {}
+            job = request(url, '/jobs', {'run': str(pathlib.Path(args.run).resolve()),
+                                         'serial': args.serial, 'overrides': overrides})
+            print(f"Job {job['id']} on {job['serial']}")
+            if args.watch:
+                for update in watch(url, job['id']):
+                    for line in update['output']:
+                        print(line)
+                print(f"Job {job['id']} {update['state']}")
+        elif args.command == 'watch':
+            for update in watch(url, args.job):
+                for line in update['output']:
+                    print(line)
+            print(f"Job {args.job} {update['state']}")
+        elif args.command == 'stop':
+            print(request(url, f'/jobs/{args.job}/stop', {}))
+        elif args.command == 'status':
+            for port in request(url, '/ports'):
+                print(f"{port['serial']}: {'busy' if port['busy'] else 'idle'}")
+            for job in request(url, '/jobs'):
+                print(f"Job {job['id']}: {job['state']} {job['run']} on {job['serial']}")
+    except RuntimeError as e:
+        print(f'ERROR: {e}')
+        sys.exit(1)
+    except urllib.error.URLError:
+        print(f'ERROR: no daemon is listening on {url}')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,8 @@
 import struct
 import sys
 
+from framebuffer import FrameBuffer
+
 def read_header(data):
     magic, = struct.unpack('<4s', data[:0x4])
     if magic != b'DTM\x1a':
@@ -50,6 +52,10 @@ def _process_input(data):
     new[1] = new_byte2
     return new
 
+_BUTTONS1 = bytes(_process_input(bytes([i, 0, 0, 0, 0, 0, 0, 0]))[0] for i in range(256))
+_BUTTONS2_FROM1 = bytes(_process_input(bytes([i, 0, 0, 0, 0, 0, 0, 0]))[1] for i in range(256))
+_BUTTONS2_FROM2 = bytes(_process_input(bytes([0, i, 0, 0, 0, 0, 0, 0]))[1] for i in range(256))
+
 def read_input(data, header=None):
     if header == None:
         header = read_header(data)
@@ -65,19 +71,24 @@ def read_input(data, header=None):
     if header['Controllers'] & 0xf0 != 0:
         raise RuntimeError('Movie Has Unsupported Controllers')
     start = 0x100
-    input_struct = struct.Struct('8s'*controllerCount)
-    input_iter = input_struct.iter_unpack(data[start:])
-    input_data = []
-    #alternate = 0
-    for frame in input_iter:
-        #alternate = 1 - alternate
-        #if alternate == 1:
-        #    continue;
-        fd = b''
-        for pd in frame:
-            fd += _process_input(pd)
-        input_data.append(fd)
-    return input_data
+    # Each output byte depends on at most two input bytes, so _process_input is
+    # applied a whole column at a time through 256 entry lookup tables
+    in_stride = 8 * controllerCount
+    body = memoryview(data)[start:]
+    count = len(body) // in_stride
+    body = body[:count * in_stride]
+    out = bytearray(count * in_stride)
+    for c in range(controllerCount):
+        base = 8 * c
+        byte1 = body[base::in_stride].tobytes()
+        byte2 = body[base + 1::in_stride].tobytes()
+        out[base::in_stride] = byte1.translate(_BUTTONS1)
+        buttons2 = (int.from_bytes(byte1.translate(_BUTTONS2_FROM1), 'little') |
+                    int.from_bytes(byte2.translate(_BUTTONS2_FROM2), 'little'))
+        out[base + 1::in_stride] = buttons2.to_bytes(count, 'little')
+        for new, old in ((2, 4), (3, 5), (4, 6), (5, 7), (6, 2), (7, 3)):
+            out[base + new::in_stride] = body[base + old::in_stride]
+    return FrameBuffer(out, in_stride)
 
 def main():
     try:
@@ -85,15 +96,15 @@ def main():
     except:
         print(f'Usage {sys.argv[0]} <movie file>')
         sys.exit()
+    # Printing the header only needs the header bytes
     with open(file, 'rb') as f:
-        data = f.read()
+        data = f.read(0x100)
     header = read_header(data)
     for k, v in header.items():
         if 'unused' in k:
             continue
         else:
             print('{}: {}'.format(k, v))
-    inputs = read_input(data, header)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+import re
+
+import threading
+
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from typing import Callable, Optional, Union
+
+class FrameBuffer:
+    '''
+    Decoded movie input stored as one contiguous block of fixed-size frames.
+
+    Indexing with an int returns that frame as bytes, like the lists the decoders
+    return, and slicing returns another FrameBuffer sharing the same memory.
+    '''
+
+    __slots__ = ('data', 'view', 'stride', 'length')
+
+    def __init__(self, data: Union[bytes, bytearray, memoryview], stride: int) -> None:
+
+        if stride <= 0:
+            raise ValueError('Frame stride must be positive')
+        self.data = data
+        self.view = memoryview(data).cast('B')
+        self.stride = stride
+        self.length = len(self.view) // stride
+
+    @classmethod
+    def from_frames(cls, frames: list, stride: Optional[int] = None) -> 'FrameBuffer':
+
+        #The frames themselves decide the stride; the argument only covers empty movies
+        if isinstance(frames, (FrameBuffer, RunLengthFrames, BlockFrames)):
+            return frames
+        if len(frames) != 0:
+            stride = len(frames[0])
+        data = bytearray().join(frames)
+        if len(data) != stride * len(frames):
+            raise ValueError('Frames are not all {} bytes long'.format(stride))
+        return cls(data, stride)
+
+    def __len__(self) -> int:
+
+        return self.length
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[bytes, 'FrameBuffer']:
+
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.length)
+            if step != 1:
+                raise ValueError('FrameBuffer slices must be contiguous')
+            stop = max(start, stop)
+            return FrameBuffer(self.view[start * self.stride:stop * self.stride], self.stride)
+        if index < 0:
+            index += self.length
+        if index < 0 or index >= self.length:
+            raise IndexError('frame index out of range')
+        offset = index * self.stride
+        return self.view[offset:offset + self.stride].tobytes()
+
+    def __iter__(self):
+
+        stride = self.stride
+        view = self.view
+        for offset in range(0, self.length * stride, stride):
+            yield view[offset:offset + stride].tobytes()
+
+    def frames(self, start: int, stop: int) -> memoryview:
+
+        #Raw bytes of frames start .. stop - 1 without copying
+        return self.view[start * self.stride:stop * self.stride]
+
+    def pack(self, dest: bytearray, offset: int, prefix: bytes, start: int, count: int) -> None:
+
+        #Write count latch packets (prefix + frame) for frames starting at start into
+        #dest at offset. Works one byte column at a time so the cost does not
+        #depend on the number of frames in Python.
+        stride = self.stride
+        pstride = len(prefix) + stride
+        end = offset + count * pstride
+        for i in range(len(prefix)):
+            dest[offset + i:end:pstride] = prefix[i:i + 1] * count
+        source = self.view[start * stride:(start + count) * stride]
+        for i in range(stride):
+            dest[offset + len(prefix) + i:end:pstride] = source[i::stride]
+
+class RunLengthFrames:
+    '''
+    Frames stored as runs of identical frames: the first frame number of every
+    run and one copy of that run's frame. Long idle stretches (menus, lag,
+    cutscenes) cost one entry instead of one frame each.
+
+    Offers the same indexing, slicing and pack() as FrameBuffer.
+    '''
+
+    __slots__ = ('starts', 'values', 'stride', 'offset', 'length')
+
+    def __init__(self, starts: array, values: FrameBuffer, length: int, offset: int = 0) -> None:
+
+        self.starts = starts
+        self.values = values
+        self.stride = values.stride
+        self.offset = offset
+        self.length = length
+
+    @classmethod
+    def from_buffer(cls, buffer: FrameBuffer, limit: Optional[int] = None) -> Optional['RunLengthFrames']:
+
+        #Gives up and returns None once there would be more than limit runs
+
+        view = buffer.view
+        stride = buffer.stride
+        count = len(buffer)
+        if count == 0:
+            return cls(array('I'), FrameBuffer(bytearray(), stride), 0)
+        #Byte i of changed is nonzero when frame i + 1 differs from frame i. Every
+        #byte column is compared with itself one frame later as one big integer,
+        #so no Python code runs per frame
+        changed = 0
+        for i in range(stride):
+            column = view[i:count * stride:stride].tobytes()
+            changed |= int.from_bytes(column[1:], 'little') ^ int.from_bytes(column[:-1], 'little')
+        changed = changed.to_bytes(count - 1, 'little')
+        if limit != None and count - changed.count(0) > limit:
+            return None
+        starts = array('I', [0])
+        starts.extend(match.start() + 1 for match in re.finditer(b'[^\\x00]', changed))
+        values = bytearray().join(view[fn * stride:(fn + 1) * stride] for fn in starts)
+        return cls(starts, FrameBuffer(values, stride), count)
+
+    def __len__(self) -> int:
+
+        return self.length
+
+    def run(self, index: int) -> int:
+
+        #Run containing absolute frame index
+        return bisect_right(self.starts, index) - 1
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[bytes, 'RunLengthFrames']:
+
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.length)
+            if step != 1:
+                raise ValueError('RunLengthFrames slices must be contiguous')
+            return RunLengthFrames(self.starts, self.values, max(0, stop - start), self.offset + start)
+        if index < 0:
+            index += self.length
+        if index < 0 or index >= self.length:
+            raise IndexError('frame index out of range')
+        return self.values[self.run(self.offset + index)]
+
+    def __iter__(self):
+
+        for run, count in self.runs(0, self.length):
+            frame = self.values[run]
+            for _ in range(count):
+                yield frame
+
+    def runs(self, start: int, count: int):
+
+        #(run, frames of that run) pairs covering count frames from start
+        fn = self.offset + start
+        stop = fn + count
+        run = self.run(fn)
+        while fn < stop:
+            end = self.starts[run + 1] if run + 1 < len(self.starts) else stop
+            end = min(end, stop)
+            yield run, end - fn
+            fn = end
+            run += 1
+
+    def frames(self, start: int, stop: int) -> bytes:
+
+        return b''.join(self.values[run] * count for run, count in self.runs(start, stop - start))
+
+    def pack(self, dest: bytearray, offset: int, prefix: bytes, start: int, count: int) -> None:
+
+        #Every frame of a run shares one encoded packet
+        pstride = len(prefix) + self.stride
+        for run, frames in self.runs(start, count):
+            dest[offset:offset + frames * pstride] = (prefix + self.values[run]) * frames
+            offset += frames * pstride
+
+class BlockFrames:
+    '''
+    Frames of a movie stored in blocks, such as a chunked.ChunkedMovie, decoded
+    one block at a time when they are first asked for. The replay's fill
+    thread inflates and decodes the blocks just ahead of the frames it packs,
+    so only a few blocks are ever held decoded.
+
+    source has block_frames, len() and frames(start, stop) giving raw movie
+    bytes; decode turns such bytes into decoded frames.
+
+    Offers the same indexing, slicing and pack() as FrameBuffer.
+    '''
+
+    __slots__ = ('source', 'decode', 'stride', 'block_frames', 'offset', 'length', 'cache', 'cache_size', 'lock')
+
+    def __init__(self, source, decode: Callable, stride: int, cache: int = 4) -> None:
+
+        self.source = source
+        self.decode = decode
+        self.block_frames = source.block_frames
+        self.offset = 0
+        self.length = len(source)
+        self.cache: OrderedDict = OrderedDict()
+        self.cache_size = cache
+        self.lock = threading.Lock()
+        #Decoders decide the stride, so ask the first block; stride only covers empty movies
+        self.stride = self.block(0).stride if self.length != 0 else stride
+
+    def block(self, index: int) -> FrameBuffer:
+
+        with self.lock:
+            if index in self.cache:
+                self.cache.move_to_end(index)
+                return self.cache[index]
+        start = index * self.block_frames
+        frames = FrameBuffer.from_frames(self.decode(self.source.frames(start, start + self.block_frames)))
+        with self.lock:
+            self.cache[index] = frames
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last = False)
+        return frames
+
+    def __len__(self) -> int:
+
+        return self.length
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[bytes, 'BlockFrames']:
+
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.length)
+            if step != 1:
+                raise ValueError('BlockFrames slices must be contiguous')
+            #Slices share the decoded blocks
+            other = BlockFrames.__new__(BlockFrames)
+            for name in self.__slots__:
+                setattr(other, name, getattr(self, name))
+            other.offset = self.offset + start
+            other.length = max(0, stop - start)
+            return other
+        if index < 0:
+            index += self.length
+        if index < 0 or index >= self.length:
+            raise IndexError('frame index out of range')
+        fn = self.offset + index
+        return self.block(fn // self.block_frames)[fn % self.block_frames]
+
+    def spans(self, start: int, count: int):
+
+        #(decoded block, first frame in it, frames) covering count frames from start
+        fn = self.offset + start
+        stop = fn + count
+        while fn < stop:
+            index = fn // self.block_frames
+            base = index * self.block_frames
+            frames = min(stop, base + self.block_frames) - fn
+            yield self.block(index), fn - base, frames
+            fn += frames
+
+    def frames(self, start: int, stop: int) -> bytes:
+
+        stop = min(stop, self.length)
+        return b''.join(block.frames(first, first + frames) for block, first, frames in self.spans(start, stop - start))
+
+    def pack(self, dest: bytearray, offset: int, prefix: bytes, start: int, count: int) -> None:
+
+        pstride = len(prefix) + self.stride
+        for block, first, frames in self.spans(start, count):
+            block.pack(dest, offset, prefix, first, frames)
+            offset += frames * pstride
+
+def compact(buffer: FrameBuffer, ratio: float = 0.5) -> Union[FrameBuffer, RunLengthFrames]:
+
+    #Switch to run-length storage when it is at most ratio times the size
+    if isinstance(buffer, (RunLengthFrames, BlockFrames)):
+        return buffer
+    limit = int(len(buffer) * buffer.stride * ratio) // (array('I').itemsize + buffer.stride)
+    rle = RunLengthFrames.from_buffer(buffer, limit)
+    return buffer if rle == None else rle
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+import threading
+
+class FrameRing:
+    '''
+    Fixed-size ring of latch packets (run prefix + frame) filled ahead of the
+    serial loop by a background thread.
+
+    frames is any frame store with a stride, a length and a pack() method that
+    writes packets straight into the ring, such as a FrameBuffer.
+
+    Frames are addressed by their absolute frame number, so the serial loop keeps
+    using run.fn and may step back a little after a buffer overflow. Reads past the
+    end of the movie are padded with blank frames instead of raising.
+    '''
+
+    def __init__(self, frames, prefix: bytes, blankframe: bytes,
+                 size: int = 8192, history: int = 1024, chunk: int = 1024) -> None:
+
+        if history >= size:
+            raise ValueError('Ring history must be smaller than the ring')
+        self.frames = frames
+        self.length = len(frames)
+        self.prefix = prefix
+        self.blank = prefix + blankframe
+        self.stride = len(prefix) + frames.stride
+        self.size = size
+        self.history = history
+        self.chunk = chunk
+        self.ring = bytearray(size * self.stride)
+        self.view = memoryview(self.ring)
+        self.written = 0 #Frames produced so far
+        self.low = 0 #Oldest frame the consumer may still ask for
+        self.target = 0 #Frames to pack in one pass rather than chunk by chunk
+        self.error = None #What stopped the fill thread, raised again to the consumer
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target = self._fill, daemon = True)
+        self.stopped = False
+
+    def start(self) -> 'FrameRing':
+
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+
+    def stage(self, stop: int) -> None:
+
+        #Ask for the frames before stop to be packed without pausing between chunks.
+        #Only a hint: it returns at once, and read() still waits if they are not there yet
+        with self.cond:
+            self._check()
+            if stop > self.target:
+                self.target = min(stop, self.length)
+                self.cond.notify_all()
+
+    def _fill(self) -> None:
+
+        try:
+            self._pack()
+        except BaseException as e:
+            with self.cond:
+                self.error = e
+                self.cond.notify_all()
+
+    def _check(self) -> None:
+
+        #Called with cond held by a consumer that is about to wait for frames
+        if self.error != None:
+            raise RuntimeError('Packing frames ahead of the replay failed') from self.error
+
+    def _pack(self) -> None:
+
+        size = self.size
+        prefix = self.prefix
+        ring = self.ring
+        frames = self.frames
+        written = 0
+        while written < self.length:
+            with self.cond:
+                while written - self.low >= size and not self.stopped:
+                    self.cond.wait()
+                if self.stopped:
+                    return
+                free = size - (written - self.low)
+                target = self.target
+            count = min(free, max(self.chunk, target - written), self.length - written)
+            slot = written % size
+            first = min(count, size - slot)
+            frames.pack(ring, slot * self.stride, prefix, written, first)
+            if first < count:
+                frames.pack(ring, 0, prefix, written + first, count - first)
+            written += count
+            with self.cond:
+                self.written = written
+                self.cond.notify_all()
+
+    def read(self, fn: int, count: int) -> bytes:
+
+        #Contiguous packets for frames fn .. fn + count - 1
+        if fn < 0:
+            count += fn
+            fn = 0
+        avail = max(0, min(count, self.length - fn))
+        if avail == 0:
+            return self.blank * count
+        stop = fn + avail
+        with self.cond:
+            if fn < self.low:
+                raise RuntimeError('Frame {} is no longer in the ring'.format(fn))
+            if fn - self.history > self.low:
+                self.low = fn - self.history
+                self.cond.notify_all()
+            while self.written < stop:
+                self._check()
+                self.cond.wait()
+        start = (fn % self.size) * self.stride
+        end = start + avail * self.stride
+        if end <= len(self.ring):
+            data = self.view[start:end].tobytes()
+        else:
+            data = self.view[start:].tobytes() + self.view[:end - len(self.ring)].tobytes()
+        if avail < count:
+            data += self.blank * (count - avail)
+        return data
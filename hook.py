@@ -5,8 +5,11 @@ import gc
 import time
 import sys
 
-from tastm32 import TAStm32, RunObject
-import r08, r16m, m64, dtm, rgen
+from tastm32 import TAStm32, RunObject, decode_movie, seek_transitions, seek_latchtrain, start_capture, at_exit, loop_stages
+
+from cursor import FrameCursor
+from schedule import EventSchedule
+from timing import StageTrace
 
 from typing import Optional
 
@@ -24,8 +27,25 @@ def main(*,
          dpcm: bool,
          overread: bool,
          blank: int = 0,
+         start: int = 0,
+         jobs: int = 1,
+         capture: Optional[str] = None,
+         run_path: Optional[str] = None,
+         cursor: Optional[str] = None,
+         metrics_port: Optional[int] = None,
+         metrics_file: Optional[str] = None,
+         trace: Optional[str] = None,
+         profile: Optional[str] = None,
+         requested: Optional[float] = None,
          nobulk: bool) -> None:
 
+    #Stage Timing
+    #requested is when the GUI asked for the run, so starting this process shows up too
+    stages = StageTrace(trace)
+    if requested != None:
+        stages.add("start process", requested, time.time())
+    at_exit(stages.save)
+
     global DEBUG
     global buffer
     global run_id
@@ -76,85 +96,107 @@ def main(*,
     print(f"{dpcm=}")
     print(f"{overread=}")
     print(f"{blank=}")
+    print(f"{start=}")
     print(f"{nobulk=}")
     '''
 
     players = list(map(int, controllers.split(",")))
 
-    dev = TAStm32(serial)
+    with stages.stage("open serial") as info:
+        dev = TAStm32(serial)
+        info["attempts"] = dev.open_attempts
+
+    #Live Input Display
+    #cursor names the shared frame number the GUI reads what is being sent from
+    if cursor != None:
+        dev.cursor = FrameCursor(cursor)
+        #Detached before shutdown, or SharedMemory complains about the view still in use
+        at_exit(dev.cursor.close)
 
     if reset == "hard reset" or reset == "soft reset":
-        dev.power_off()
-        if reset == "hard reset":
-            time.sleep(2.0) #TODO: FIXME?
+        with stages.stage("power off", reset = reset):
+            dev.power_off()
+            if reset == "hard reset":
+                time.sleep(2.0) #TODO: FIXME?
 
     #No need for clock check cause the GUI did that already
 
     #TODO: Open movie
     data = movie
 
-    dev.reset()
+    with stages.stage("reset"):
+        dev.reset()
 
     #Setup Run
-    run_id = dev.setup_run(console, players, dpcm, overread, clock)
+    with stages.stage("setup run"):
+        run_id = dev.setup_run(console, players, dpcm, overread, clock)
     if run_id == None:
         raise RuntimeError("Failed to setup run.")
         sys.exit()
 
+    #Metrics
+    if metrics_port != None or metrics_file != None:
+        import metrics
+        metrics.start(dev, metrics_port, metrics_file)
+
+    #Capture Log
+    #run_path is the .tas file the movie came from, so the capture can be replayed
+    if capture != None:
+        start_capture(dev, capture, run_id, console, players, run_path, start, blank)
+
     #Setup Console
-    if console == 'n64':
-        buffer = m64.read_input(data)
-        blankframe = b'\x00\x00\x00\x00' * len(players)
-    elif console == 'snes':
-        buffer = r16m.read_input(data, players)
-        blankframe = b'\x00\x00' * len(players)
-    elif console == 'nes':
-        buffer = r08.read_input(data, players)
-        blankframe = b'\x00' * len(players)
-    elif console == 'gc':
-        buffer = dtm.read_input(data)
-        blankframe = b'\x00\x00\x00\x00\x00\x00\x00\x00' * len(players)
-    elif console == 'genesis':
-        buffer = rgen.read_input(data, players)
-        blankframe = b'\x00\x00' * len(players)
+    with stages.stage("decode", jobs = jobs) as info:
+        buffer, blankframe = decode_movie(console, data, players, jobs=jobs)
+        info["frames"] = len(buffer)
+
+    #Seek
+    if start != 0:
+        if start < 0 or start >= len(buffer):
+            raise RuntimeError(f"Start frame {start} is outside the movie.")
+        print(f"Starting at frame {start}.") #TODO: Pipe?
+        buffer = buffer[start:]
+    transitions = seek_transitions(transitions, start)
+    latchtrain = seek_latchtrain(latchtrain, start)
 
     #Setup Transitions
     if transitions != None:
-        for transition in transitions:
-            dev.send_transition(run_id, *transition)
-
-    #Send Blank Frames
-    for _ in range(blank):
-        data = run_id + blankframe
-        dev.write(data)
-    print(f"Sending Blank Latches: {blank}.") #TODO: Pipe?
+        with stages.stage("transitions", count = len(transitions)):
+            for transition in transitions:
+                dev.send_transition(run_id, *transition)
+
+    with stages.stage("prefill", blank = blank) as info:
+        #Send Blank Frames
+        for _ in range(blank):
+            data = run_id + blankframe
+            dev.write(data)
+        print(f"Sending Blank Latches: {blank}.") #TODO: Pipe?
 
-    fn = 0
-    for latch in range(int_buffer - blank):
-        try:
+        fn = 0
+        for latch in range(min(int_buffer - blank, len(buffer))):
             data = run_id + buffer[fn]
             dev.write(data)
             if fn % 100 == 0:
                 print(f"Sending Latch: {fn}.") #TODO: Pipe?
             fn += 1
-        except IndexError:
-            pass
 
-    err = dev.read(int_buffer)
-    fn -= err.count(b"\xB0")
-    if err.count(b"\xB0") != 0:
-        print('Buffer Overflow x{}'.format(err.count(b'\xB0')))
+        err = dev.read(int_buffer)
+        fn -= err.count(b"\xB0")
+        if err.count(b"\xB0") != 0:
+            print('Buffer Overflow x{}'.format(err.count(b'\xB0')))
+        info["frames"] = fn
 
     #Latch Trains
     if latchtrain != []:
-        dev.send_latchtrain(run_id, latchtrain)
+        with stages.stage("latch train", count = len(latchtrain)):
+            dev.send_latchtrain(run_id, latchtrain)
 
-    run = RunObject(run_id, buffer, fn, blankframe)
+    events = EventSchedule(transitions, latchtrain)
+    run = RunObject(run_id, buffer, fn, blankframe, schedule = events, buffered = blank + fn)
     print("Main Loop Start.") #TODO: Pipe?
     if not nobulk:
         dev.set_bulk_data_mode(run_id, b"1")
     dev.power_on()
-    dev.main_loop(run)
+    loop_stages(dev, run, stages, profile)
     print("Exiting.") #TODO: Pipe?
     sys.exit(0)
     
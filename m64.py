@@ -2,6 +2,8 @@
 import struct
 import sys
 
+import columns
+
 def read_header(data):
     magic, version = struct.unpack('<4sI', data[:0x8])
     if magic != b'M64\x1a':
@@ -28,21 +30,30 @@ def read_header(data):
     header['description'] = header['description'].decode('utf8').rstrip('\x00')
     return header
 
-def read_input(data, header=None):
+layout_struct = struct.Struct('<4sI12xBB')
+
+def read_layout(data):
+    # Only the fields needed to find the input data, without decoding the whole header
+    magic, version, fps, controllers = layout_struct.unpack_from(data, 0)
+    if magic != b'M64\x1a':
+        raise RuntimeError('Bad movie magic')
+    return {'magic': magic, 'version': version, 'fps': fps, 'controllers': controllers}
+
+def read_input(data, header=None, players=[1]):
     if header == None:
-        header = read_header(data)
+        header = read_layout(data)
     if header['version'] == 1 or header['version'] == 2:
         start = 0x200
     elif header['version'] == 3:
         start = 0x400
     else:
         raise RuntimeError('Movie version invalid')
-    input_struct = struct.Struct('4s'*header['controllers'])
-    input_iter = input_struct.iter_unpack(data[start:])
-    input_data = []
-    for frame in input_iter:
-        input_data.append(frame[0])
-    return input_data
+    controllers = max(header['controllers'], 1)
+    for player in players:
+        if int(player) < 1 or int(player) > controllers:
+            raise RuntimeError('Movie has no input for player {}'.format(player))
+    ports = tuple(range(1, controllers + 1))
+    return columns.select(memoryview(data)[start:], 4 * controllers, columns.gather_map(ports, 4, players))
 
 def main():
     try:
@@ -50,15 +61,15 @@ def main():
     except:
         print(f'Usage {sys.argv[0]} <movie file>')
         sys.exit()
+    # Printing the header only needs the header bytes
     with open(file, 'rb') as f:
-        data = f.read()
+        data = f.read(0x400)
     header = read_header(data)
     for k, v in header.items():
         if 'unused' in k:
             continue
         else:
             print('{}: {}'.format(k, v))
-    inputs = read_input(data, header)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
+import os
 import zipfile
 import json
 import time
+import threading
+import urllib.error
 import serial
 import serial.tools.list_ports
 from pathlib import Path
@@ -11,11 +14,19 @@ import tkinter as tk
 import tkinter.ttk as ttk
 from multiprocessing import Process
 
-from widgets import ControllerSelector, TransitionsTable
+from widgets import ControllerSelector, TransitionsTable, InputDisplay, Timeline
+from worker import WorkerPool
+from cursor import FrameCursor
+from tastm32 import decode_movie
+import activity
+import chunked
+import consoles
+import daemon
 from hook import main
 
 #Run Unpacker
-def readRun(run: tk.StringVar) -> [dict, bytes]:
+#raw returns the movie member as stored (possibly chunked) instead of the movie file
+def readRun(run: tk.StringVar, raw: bool = False) -> [dict, bytes]:
 
     with zipfile.ZipFile(run.get()) as z:
         with z.open("run.json") as j:
@@ -24,6 +35,8 @@ def readRun(run: tk.StringVar) -> [dict, bytes]:
                 return data, b""
             with z.open(data["movie"]) as m:
                 movie: bytes = m.read()
+                if not raw:
+                    movie = chunked.unpack(movie)
                 return data, movie
 
 def getSerialPorts() -> list:
@@ -59,8 +72,11 @@ class App(tk.Tk):
 
         #Child Process Containers
         self.child = None
+        #Keep a replay process warm so pressing Run does not pay for imports
+        self.pool = WorkerPool()
         
         super().__init__(*args, **kwargs)
+        self.protocol("WM_DELETE_WINDOW", self.onClose)
         self.grid_rowconfigure(0, weight = 1)
         self.grid_rowconfigure(1, weight = 1)
         self.grid_columnconfigure(0, weight = 1)
@@ -90,7 +106,8 @@ class App(tk.Tk):
         self.runSelector = tk.OptionMenu(self.controlFrame, self.run, *self.runs)
         self.runSelector.pack(fill = "x")
         if self.run.get() != "No runs found":
-            info, self.movie = readRun(self.run) #Get the info for the run to populate other widgets
+            info, self.storedMovie = readRun(self.run, raw = True) #Get the info for the run to populate other widgets
+            self.movie = chunked.unpack(self.storedMovie)
         else:
             info = {
                 "name": "",
@@ -109,6 +126,7 @@ class App(tk.Tk):
                 "latch train": "",
                 "movie": ""}
             self.movie = None
+            self.storedMovie = None
         cso = info["console specific options"]
 
         self.movie_name = info["movie"]
@@ -193,6 +211,20 @@ class App(tk.Tk):
                                                textvariable = self.blank_frames)
         self.blank_frames_spinbox.grid(row = 0, column = 1)
         self.blank_frames_frame.pack(fill = "x")
+
+        #Start Frame
+        #Not saved with the run; only used to resume an attempt from a desync
+        self.start_frame_frame = makeDuoFrame(self.controlFrame)
+        label = tk.Label(self.start_frame_frame, text = "Start Frame")
+        label.grid(row = 0, column = 0)
+        self.start_frame = tk.IntVar(self, 0)
+        self.start_frame_spinbox = tk.Spinbox(self.start_frame_frame,
+                                              increment = 1,
+                                              from_ = 0,
+                                              to = 99999999,
+                                              textvariable = self.start_frame)
+        self.start_frame_spinbox.grid(row = 0, column = 1)
+        self.start_frame_frame.pack(fill = "x")
         
         #Intiial Power Setting
         self.initial_power_frame = makeDuoFrame(self.controlFrame)
@@ -231,6 +263,12 @@ class App(tk.Tk):
                                               textvariable = self.latch_train)
         self.latch_train_entry.pack(fill = "x")
         #TODO: Add scrollbar
+
+        #Timeline
+        self.timeline = Timeline(self.controlFrame)
+        self.timeline.pack(fill = "x")
+        self.timelineJob = None
+        self.timelineThread = None
         
         #Information Frame
         #Static Information
@@ -248,6 +286,11 @@ class App(tk.Tk):
         description = tk.Label(self.infoFrame, textvariable = self.description)
         description.pack(fill = "x")
 
+        #Input Display
+        self.inputDisplay = InputDisplay(self.infoFrame)
+        self.inputDisplay.pack(fill = "x")
+        self.cursor = None
+
         #TAStm32 Frame
 
         self.progress = ttk.Progressbar(self.tastm32Frame, mode = "determinate")
@@ -300,6 +343,32 @@ class App(tk.Tk):
         self.debug_checkbutton.grid(row = 0, column = 1)
         self.debug_frame.pack(fill = "x", side = tk.BOTTOM)
 
+        #Capture Selector
+        #Logs everything sent and received next to the run for capture.py
+        self.capture_frame = makeDuoFrame(self.tastm32Frame)
+        label = tk.Label(self.capture_frame, text = "Capture Log")
+        label.grid(row = 0, column = 0)
+        self.capture = tk.BooleanVar(self, value = False)
+        self.capture_checkbutton = tk.Checkbutton(self.capture_frame,
+                                                  onvalue = True,
+                                                  offvalue = False,
+                                                  variable = self.capture)
+        self.capture_checkbutton.grid(row = 0, column = 1)
+        self.capture_frame.pack(fill = "x", side = tk.BOTTOM)
+
+        #Trace Selector
+        #Times every stage from pressing Run to the end of the run for chrome://tracing
+        self.trace_frame = makeDuoFrame(self.tastm32Frame)
+        label = tk.Label(self.trace_frame, text = "Trace Stages")
+        label.grid(row = 0, column = 0)
+        self.trace = tk.BooleanVar(self, value = False)
+        self.trace_checkbutton = tk.Checkbutton(self.trace_frame,
+                                                onvalue = True,
+                                                offvalue = False,
+                                                variable = self.trace)
+        self.trace_checkbutton.grid(row = 0, column = 1)
+        self.trace_frame.pack(fill = "x", side = tk.BOTTOM)
+
         #Serial Port Selector
         self.serial = tk.StringVar(self, self.devices[0])
         self.serial_optionmenu = tk.OptionMenu(self.tastm32Frame,
@@ -309,6 +378,9 @@ class App(tk.Tk):
         label = tk.Label(self.tastm32Frame, text = "Serial Port")
         label.pack(fill = "x", side = tk.BOTTOM)
 
+        #Build the timeline for the first run
+        self.timelineCallback()
+
         #Call callback to get intial text for readout
         self.commandReadoutCallback()
         
@@ -318,6 +390,7 @@ class App(tk.Tk):
         self.console.trace_add("write", self.commandReadoutCallback)
         self.controllerSelector.addCallback(self.commandReadoutCallback)
         self.blank_frames.trace_add("write", self.commandReadoutCallback)
+        self.start_frame.trace_add("write", self.commandReadoutCallback)
         self.initial_power.trace_add("write", self.commandReadoutCallback)
         self.latch_filter.trace_add("write", self.commandReadoutCallback)
         self.clock_filter.trace_add("write", self.commandReadoutCallback)
@@ -326,10 +399,14 @@ class App(tk.Tk):
         self.bulk_data.trace_add("write", self.commandReadoutCallback)
         self.serial.trace_add("write", self.commandReadoutCallback)
         self.debug.trace_add("write", self.commandReadoutCallback)
+        self.controllerSelector.addCallback(self.timelineCallback)
+        self.capture.trace_add("write", self.commandReadoutCallback)
+        self.trace.trace_add("write", self.commandReadoutCallback)
         
     #runSelector Callback
     def runSelectorCallback(self, *args):
-        info, self.movie = readRun(self.run) #Get the info for the run to populate other widgets
+        info, self.storedMovie = readRun(self.run, raw = True) #Get the info for the run to populate other widgets
+        self.movie = chunked.unpack(self.storedMovie)
         cso = info["console specific options"]
         #Dynamic Info
         self.controllerSelector.setStates(info["controllers"])
@@ -382,9 +459,54 @@ class App(tk.Tk):
         self.description.set(info["description"])
 
         self.movie_name = info["movie"]
+
+        self.timelineCallback()
             
         
 
+    def timelineCallback(self, *args):
+
+        #Changing runs fires this once per controller box, so build once when idle
+        if self.timelineJob == None:
+            self.timelineJob = self.after_idle(self.buildTimeline)
+
+    def buildTimeline(self):
+
+        #The activity index is built on another thread so long movies do not
+        #freeze the window. It is cached, so switching back to a movie is instant
+        self.timelineJob = None
+        if self.movie in (None, b"") or self.controllerSelector.getStates() == "":
+            self.timelineThread = None
+            self.timeline.setIndex(None)
+            return
+        console = self.console.get()
+        movie = self.movie
+        players = list(map(int, self.controllerSelector.getStates().split(",")))
+        built = []
+
+        def build():
+            try:
+                built.append(activity.movie_index(console, movie, players))
+            except Exception:
+                #The players or console do not fit the movie (yet)
+                pass
+
+        thread = threading.Thread(target = build, daemon = True)
+        self.timelineThread = thread
+        thread.start()
+        self.after(50, self.showTimeline, thread, built)
+
+    def showTimeline(self, thread: threading.Thread, built: list) -> None:
+
+        #Runs on the Tk thread until the activity index is built
+        if self.timelineThread is not thread:
+            #The movie or players changed while it was being built
+            return
+        if thread.is_alive():
+            self.after(50, self.showTimeline, thread, built)
+        else:
+            self.timeline.setIndex(built[0] if len(built) > 0 else None)
+
     def commandReadoutCallback(self, *args):
 
         cmd = "python3 tastm32.py "
@@ -397,6 +519,8 @@ class App(tk.Tk):
             cmd += f"--players {self.controllerSelector.getStates()} "
         if self.blank_frames.get() > 0:
             cmd += f"--blank {self.blank_frames.get()} "
+        if self.start_frame.get() > 0:
+            cmd += f"--start {self.start_frame.get()} "
         if self.latch_filter.get() == True:
             cmd += "--dpcm "
         if self.initial_power.get() == "hard reset":
@@ -416,8 +540,13 @@ class App(tk.Tk):
             cmd += f"--latchtrain {self.latch_train.get()} "
         if self.bulk_data.get() == False:
             cmd += f"--nobulk "
+        if self.capture.get() == True:
+            cmd += f"--capture {self.capturePath()} "
+        if self.trace.get() == True:
+            cmd += f"--trace {self.tracePath()} "
         cmd += self.movie_name
         self.readout.set(cmd)
+        self.timeline.setMarks(self.transitionsTable.get(), self.latch_train.get())
 
         valid = True
 
@@ -454,27 +583,106 @@ class App(tk.Tk):
             "controllers": self.controllerSelector.getStates(),
             "serial": self.serial.get(),
             "reset": None if self.initial_power.get() == "none" else self.initial_power.get(),
-            "clock": None if self.clock_filter.get() == 0 else self.clock_filter.get(),
-            "movie": self.movie,
+            #The run keeps microseconds, the device counts quarters of one
+            "clock": None if self.clock_filter.get() == 0 else int(self.clock_filter.get() * 4),
+            #The replay gets the movie as stored; a chunked one is decoded as it is reached
+            "movie": self.storedMovie,
             "console": self.console.get().lower(),
             "dpcm": self.latch_filter.get(),
             "overread": self.overread.get(),
             "blank": self.blank_frames.get(),
+            "start": self.start_frame.get(),
+            "capture": self.capturePath() if self.capture.get() else None,
+            "trace": self.tracePath() if self.trace.get() else None,
+            "requested": time.time(),
+            "run_path": str(Path(self.run.get()).resolve()),
             "nobulk": not self.bulk_data.get()
             }        
 
-        self.child = Process(target = main, kwargs = kwargs)
-        self.child.start()
+        #The replay process only stores its frame number in the cursor;
+        #the display decodes its own copy of the movie to show the buttons
+        if self.cursor != None:
+            self.inputDisplay.stop()
+            self.cursor.close()
+        self.cursor = FrameCursor()
+        kwargs["cursor"] = self.cursor.name
+
+        #With TASTM32_DAEMON set to the address of daemon.py the replay runs there
+        #from the saved .tas file, with the settings shown here
+        url = os.environ.get("TASTM32_DAEMON")
+        if url:
+            overrides = {key: value for key, value in kwargs.items() if key in daemon.OVERRIDES}
+            #The daemon only writes files into its own log directory
+            for key in daemon.PATHS:
+                if overrides.get(key) != None:
+                    overrides[key] = Path(overrides[key]).name
+            try:
+                job = daemon.request(url, "/jobs", {"run": kwargs["run_path"], "serial": kwargs["serial"], "overrides": overrides})
+            except (RuntimeError, urllib.error.URLError) as e:
+                self.readout.set(f"Daemon at {url}: {e}")
+                return
+            self.child = daemon.RemoteJob(url, job)
+        else:
+            try:
+                self.child = self.pool.acquire()
+            except RuntimeError as e:
+                self.readout.set(str(e))
+                return
+            self.child.start(main, **kwargs)
+
+        #Only now decode the display's copy, on another thread, so neither the
+        #replay nor the window waits for it
+        players = list(map(int, kwargs["controllers"].split(",")))
+        movie = self.movie
+        decoded = []
+
+        def decode():
+            decoded.append(decode_movie(kwargs["console"], movie, players, jobs = 1)[0])
+
+        thread = threading.Thread(target = decode, daemon = True)
+        thread.start()
+        self.after(50, self.showInputs, thread, decoded, self.cursor, self.child, kwargs["console"], self.start_frame.get())
+
+    def showInputs(self, thread: threading.Thread, decoded: list, cursor: FrameCursor, child, console: str, start: int) -> None:
+
+        #Runs on the Tk thread until the display's frames are decoded
+        if self.cursor is not cursor:
+            #A newer run took over the display
+            return
+        if thread.is_alive():
+            self.after(50, self.showInputs, thread, decoded, cursor, child, console, start)
+        elif len(decoded) > 0:
+            self.inputDisplay.watch(cursor, decoded[0][start:], consoles.get(console), child.is_alive)
+
+    def capturePath(self) -> str:
+
+        return f"{Path(self.run.get()).with_suffix('')}-{time.strftime('%Y%m%d-%H%M%S')}.tscap"
+
+    def tracePath(self) -> str:
+
+        return f"{Path(self.run.get()).with_suffix('')}-{time.strftime('%Y%m%d-%H%M%S')}.trace.json"
 
     def stopRun(self):
 
         if self.child != None:
             if self.child.is_alive():
-                self.child.terminate()
+                try:
+                    self.child.terminate()
+                except (RuntimeError, urllib.error.URLError):
+                    pass
+
+    def onClose(self):
+
+        self.stopRun()
+        self.inputDisplay.stop()
+        if self.cursor != None:
+            self.cursor.close()
+        self.pool.close()
+        self.destroy()
 
     def saveRun(self):
 
-        info, movie = readRun(self.run)
+        info, movie = readRun(self.run, raw = True)
         cso = "console specific options"
         info[cso]["latch filter"] = self.latch_filter.get()
         info[cso]["clock filter"] = self.clock_filter.get()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import zipfile
+import pathlib
+
+from typing import Optional
+
+import chunked
+import consoles
+
+class MovieInfo:
+    '''
+    What can be known about a movie from its header and size alone.
+    '''
+
+    __slots__ = ('path', 'member', 'format', 'size', 'frame_count', 'controllers', 'rom', 'header')
+
+    def __init__(self, path: str, member: Optional[str], format: str, size: int,
+                 frame_count: int, controllers: int, rom: Optional[str], header: Optional[dict]) -> None:
+
+        self.path = path
+        self.member = member
+        self.format = format
+        self.size = size
+        self.frame_count = frame_count
+        self.controllers = controllers
+        self.rom = rom
+        self.header = header
+
+    def __repr__(self) -> str:
+
+        name = self.path if self.member == None else f'{self.path}:{self.member}'
+        return (f'MovieInfo({name!r}, format={self.format!r}, frames={self.frame_count}, '
+                f'controllers={self.controllers}, rom={self.rom!r})')
+
+def _describe(fmt: str, head: bytes, size: int) -> tuple:
+
+    #Frame count, controllers, ROM identity and parsed header from the header bytes
+    start, stride, controllers = consoles.for_extension(fmt).layout(head)
+    header = None
+    rom = None
+    if fmt == 'm64':
+        import m64
+        header = m64.read_header(head)
+        rom = f"{header['rom name']} ({header['rom crc32']})"
+    elif fmt == 'dtm':
+        import dtm
+        header = dtm.read_header(head)
+        rom = f"{header['Game ID'].decode('ascii', 'replace')} ({header['MD5 Hash'].hex()})"
+    return max(0, size - start) // stride, controllers, rom, header
+
+def _read_head(f, start: int, size: int) -> tuple:
+
+    #Header bytes and raw movie size of an open movie file, chunked or not.
+    #Chunked movies keep the original header right after their own
+    head = f.read(max(start, chunked.header_struct.size))
+    if chunked.is_chunked(head):
+        size = chunked.header_struct.unpack_from(head, 0)[5]
+        head = head[chunked.header_struct.size:] + f.read(start)
+    return head[:start], size
+
+_cache: dict = {}
+
+def read_metadata(path: str, member: Optional[str] = None, fmt: Optional[str] = None) -> MovieInfo:
+    '''
+    Metadata of a movie file, or of a movie stored as member of a zip/.tas file.
+    Only the header bytes are read. Results are cached until the file changes.
+    '''
+
+    st = os.stat(path)
+    key = (os.path.abspath(path), member, st.st_mtime_ns, st.st_size)
+    if key in _cache:
+        return _cache[key]
+    name = member if member != None else path
+    if fmt == None:
+        fmt = pathlib.Path(name).suffix.lower().lstrip('.')
+    start = consoles.for_extension(fmt).header_size
+    if member == None:
+        with open(path, 'rb') as f:
+            head, size = _read_head(f, start, st.st_size)
+    else:
+        with zipfile.ZipFile(path) as z:
+            with z.open(member) as m:
+                head, size = _read_head(m, start, z.getinfo(member).file_size)
+    frame_count, controllers, rom, header = _describe(fmt, head, size)
+    info = MovieInfo(path, member, fmt, size, frame_count, controllers, rom, header)
+    _cache[key] = info
+    return info
+
+def read_run_metadata(path: str) -> MovieInfo:
+
+    #Metadata of the movie inside a .tas file
+    with zipfile.ZipFile(path) as z:
+        with z.open('run.json') as j:
+            run = json.load(j)
+    if run['movie'] in ('', None):
+        raise RuntimeError('Run has no movie')
+    fmt = consoles.get(run['console']).extension
+    return read_metadata(path, run['movie'], fmt)
+
+def main():
+    try:
+        target = sys.argv[1]
+    except:
+        print(f'Usage {sys.argv[0]} <movie, .tas file or directory>')
+        sys.exit()
+    if os.path.isdir(target):
+        extensions = [console.extension for console in consoles.CONSOLES.values()] + ['tas']
+        paths = sorted(p for p in pathlib.Path(target).rglob('*')
+                       if p.suffix.lower().lstrip('.') in extensions)
+    else:
+        paths = [pathlib.Path(target)]
+    t0 = time.perf_counter()
+    for p in paths:
+        try:
+            if p.suffix.lower() == '.tas':
+                info = read_run_metadata(str(p))
+            else:
+                info = read_metadata(str(p))
+            print(info)
+        except Exception as e:
+            print(f'{p}: {e}')
+    elapsed = time.perf_counter() - t0
+    print(f'{len(paths)} files in {elapsed * 1000:.1f} ms')
+
+if __name__ == '__main__':
+    main()
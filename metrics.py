@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+import os
+import time
+import threading
+import psutil
+
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+QUANTILES = (0.5, 0.9, 0.99)
+SAMPLES = 4096
+
+class Metrics:
+    '''
+    Numbers about a replay for dashboards, in the Prometheus text format.
+
+    main_loop keeps counting into run.stats as it always has, and write()
+    stores how long every write took in a fixed ring of samples. Only the
+    replay thread changes them; render() runs on the exporter thread and
+    only reads them, so the replay never waits on a lock or grows a list.
+    '''
+
+    def __init__(self, samples: int = SAMPLES) -> None:
+
+        if samples & (samples - 1) != 0:
+            raise RuntimeError('The number of write time samples must be a power of two')
+        # The RunObject main_loop is playing
+        self.run = None
+        self.times = array('d', bytes(8 * samples))
+        self.mask = samples - 1
+        self.writes = 0
+        self.write_seconds = 0.0
+        self.process = psutil.Process()
+        self.process.cpu_percent(None)
+
+    def write_time(self, seconds: float) -> None:
+
+        self.times[self.writes & self.mask] = seconds
+        self.writes += 1
+        self.write_seconds += seconds
+
+    def quantiles(self) -> list:
+
+        # Over the most recent writes; a sample being overwritten meanwhile only moves one value
+        samples = sorted(self.times[:min(self.writes, self.mask + 1)])
+        if samples == []:
+            return [(q, float('nan')) for q in QUANTILES]
+        return [(q, samples[min(len(samples) - 1, int(q * len(samples)))]) for q in QUANTILES]
+
+    def render(self, last: Optional[list] = None) -> str:
+
+        # last is the [time, latches] of the previous render for the same reader,
+        # which the latch rate is measured from and which is updated here
+        lines = []
+
+        def metric(name, kind, help, values):
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in values:
+                lines.append(f'{name}{labels} {value}')
+
+        run = self.run
+        if run != None:
+            stats = run.stats
+            label = f'run="{run.run_id.decode()}"'
+            metric('tastm32_latches_total', 'counter', 'Latches the console asked for one at a time',
+                   [(f'{{{label}}}', stats.latches)])
+            if last != None:
+                now = time.monotonic()
+                rate = (stats.latches - last[1]) / max(now - last[0], 1e-9) if last[0] != None else 0.0
+                last[:] = [now, stats.latches]
+                metric('tastm32_latch_rate', 'gauge', 'Latches per second since the previous scrape',
+                       [(f'{{{label}}}', round(rate, 3))])
+            metric('tastm32_bulk_requests_total', 'counter', 'Bulk data requests from the device',
+                   [(f'{{{label}}}', stats.bulk)])
+            metric('tastm32_overflows_total', 'counter', 'Buffer overflows reported by the device',
+                   [(f'{{{label}}}', stats.overflows)])
+            metric('tastm32_train_events_total', 'counter', 'Latch train corrections and results',
+                   [(f'{{{label},event="skip"}}', stats.train_skips),
+                    (f'{{{label},event="extra"}}', stats.train_extras),
+                    (f'{{{label},event="success"}}', stats.train_success),
+                    (f'{{{label},event="failed"}}', stats.train_failed)])
+            metric('tastm32_buffer_level', 'gauge', 'Estimated frames waiting in the device when it last asked for more',
+                   [(f'{{{label}}}', stats.buffer_level)])
+            metric('tastm32_buffer_low', 'gauge', 'Fewest frames estimated to be waiting in the device so far',
+                   [(f'{{{label}}}', stats.buffer_low)])
+            metric('tastm32_frame', 'gauge', 'Next frame of the movie to be sent',
+                   [(f'{{{label}}}', run.fn)])
+            metric('tastm32_frames', 'gauge', 'Frames in the movie',
+                   [(f'{{{label}}}', run.length)])
+        metric('tastm32_write_seconds', 'summary', 'Time spent in each serial write',
+               [(f'{{quantile="{q}"}}', value) for q, value in self.quantiles()] +
+               [('_sum', self.write_seconds), ('_count', self.writes)])
+        cpu = self.process.cpu_times()
+        metric('process_cpu_seconds_total', 'counter', 'CPU time of the replay process',
+               [('', cpu.user + cpu.system)])
+        metric('process_cpu_percent', 'gauge', 'CPU use of the replay process since the previous scrape',
+               [('', self.process.cpu_percent(None))])
+        metric('process_resident_memory_bytes', 'gauge', 'Resident memory of the replay process',
+               [('', self.process.memory_info().rss)])
+        return '\n'.join(lines) + '\n'
+
+def serve(metrics: Metrics, port: int) -> ThreadingHTTPServer:
+
+    # GET /metrics on localhost, answered from a background thread
+    last = [None, 0]
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.render(last).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def export(metrics: Metrics, path: str, interval: float = 1.0) -> threading.Thread:
+
+    # Rewrite path every interval seconds, e.g. for node_exporter's textfile collector.
+    # Readers never see half a file because it is replaced in one rename
+    def loop():
+        temp = path + '.tmp'
+        last = [None, 0]
+        while True:
+            with open(temp, 'w') as f:
+                f.write(metrics.render(last))
+            os.replace(temp, path)
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+    return thread
+
+def start(dev, port: Optional[int] = None, path: Optional[str] = None) -> Metrics:
+
+    # Count into dev from now on and export the numbers the requested ways
+    dev.metrics = Metrics()
+    if port != None:
+        serve(dev.metrics, port)
+        print(f'Metrics on http://127.0.0.1:{port}/metrics')
+    if path != None:
+        export(dev.metrics, path)
+        print(f'Metrics written to {path}')
+    return dev.metrics
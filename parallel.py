@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import Optional
+
+import chunked
+import consoles
+import worker
+from framebuffer import FrameBuffer
+
+# Movies shorter than this many frames per worker decode faster serially than
+# it takes to start the workers
+MIN_FRAMES = 500_000
+
+def _decode_range(console: str, players: list, header: Optional[dict], in_name: str, start: int,
+                  stride: int, first: int, last: int, out_name: str, out_stride: int) -> None:
+
+    #Decode frames first .. last - 1 into their place in the shared output
+    shm_in = SharedMemory(in_name)
+    shm_out = SharedMemory(out_name)
+    try:
+        buf = shm_in.buf
+        data = bytes(buf[:start]) + bytes(buf[start + first * stride:start + last * stride])
+        del buf
+        frames = FrameBuffer.from_frames(consoles.get(console).decode(data, players, header))
+        view = frames.frames(0, len(frames))
+        shm_out.buf[first * out_stride:last * out_stride] = view
+        del view, frames
+    finally:
+        shm_in.close()
+        shm_out.close()
+
+def decode(console: str, data: bytes, players: list, header: Optional[dict] = None,
+           workers: Optional[int] = None, min_frames: int = MIN_FRAMES) -> FrameBuffer:
+    '''
+    Decode a movie by splitting it into frame ranges and decoding them in
+    several processes, each writing straight into one shared output buffer.
+    The result is identical to the serial decoder's.
+    '''
+
+    fmt = consoles.get(console)
+    start, stride = chunked.layout(console, data)
+    count = max(0, len(data) - start) // stride
+    if workers == None or workers <= 0:
+        workers = os.cpu_count() or 1
+    workers = min(workers, count // min_frames)
+    if workers <= 1:
+        return FrameBuffer.from_frames(fmt.decode(data, players, header), fmt.frame_size * len(players))
+
+    #Decode one frame first to learn the output stride
+    probe = FrameBuffer.from_frames(fmt.decode(bytes(data[:start + stride]), players, header))
+    out_stride = probe.stride
+    bounds = [count * i // workers for i in range(workers + 1)]
+    shm_in = SharedMemory(create = True, size = len(data))
+    shm_out = SharedMemory(create = True, size = count * out_stride)
+    try:
+        shm_in.buf[:len(data)] = data
+        with ProcessPoolExecutor(workers, mp_context = worker.getContext()) as pool:
+            futures = [pool.submit(_decode_range, console, players, header, shm_in.name, start, stride,
+                                   bounds[i], bounds[i + 1], shm_out.name, out_stride)
+                       for i in range(workers)]
+            for future in futures:
+                future.result()
+        out = bytearray(shm_out.buf[:count * out_stride])
+    finally:
+        shm_in.close()
+        shm_in.unlink()
+        shm_out.close()
+        shm_out.unlink()
+    return FrameBuffer(out, out_stride)
+
+def main():
+    try:
+        console = sys.argv[1]
+        file = sys.argv[2]
+    except:
+        print(f'Usage {sys.argv[0]} <console> <movie file> [players] [workers]')
+        sys.exit()
+    players = [int(x) for x in sys.argv[3].split(',')] if len(sys.argv) > 3 else [1]
+    workers = int(sys.argv[4]) if len(sys.argv) > 4 else None
+    with open(file, 'rb') as f:
+        data = f.read()
+    t0 = time.perf_counter()
+    serial = FrameBuffer.from_frames(consoles.get(console).decode(data, players))
+    t1 = time.perf_counter()
+    frames = decode(console, data, players, workers = workers, min_frames = 1)
+    t2 = time.perf_counter()
+    same = frames.frames(0, len(frames)) == serial.frames(0, len(serial))
+    print(f'{len(frames)} frames: serial {t1 - t0:.3f} s, parallel {t2 - t1:.3f} s, identical: {same}')
+
+if __name__ == '__main__':
+    main()
@@ -1,23 +1,17 @@
 #!/usr/bin/env python3
-import struct
 import sys
 
+import columns
+
 def read_header(data):
     return None
 
+PORTS = (1, 2, 3, 4, 5, 6, 7, 8)
+FIELD_SIZE = 2
+
 def read_input(data, players=[1,2,3,4,5,6,7,8]):
-    frame_struct = struct.Struct('2s2s2s2s2s2s2s2s')
-    frame_iter = frame_struct.iter_unpack(data)
-    input_data = []
-    for frame in frame_iter:
-        fd = b''
-        player = 1
-        for pd in frame:
-            if player in players:
-                fd += pd
-            player += 1
-        input_data.append(fd)
-    return input_data
+    offsets = columns.gather_map(PORTS, FIELD_SIZE, players)
+    return columns.select(data, len(PORTS) * FIELD_SIZE, offsets)
 
 def main():
     try:
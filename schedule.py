@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+import sys
+import heapq
+
+from typing import Optional
+
+NEVER = sys.maxsize
+
+TRANSITION_NAMES = {b'A': 'ACE mode', b'N': 'Normal mode', b'S': 'Soft reset', b'H': 'Hard reset'}
+
+class Event:
+
+    __slots__ = ('frame', 'kind', 'detail')
+
+    def __init__(self, frame: int, kind: str, detail) -> None:
+
+        self.frame = frame
+        self.kind = kind
+        self.detail = detail
+
+    def __repr__(self) -> str:
+
+        if self.kind == 'transition':
+            mode = TRANSITION_NAMES.get(self.detail, self.detail)
+            return f'{mode} transition at frame {self.frame}'
+        index, latches = self.detail
+        return f'end of latch train {index + 1} ({latches} latches) at frame {self.frame}'
+
+class EventSchedule:
+    '''
+    Frames at which the device will switch transitions or finish a latch
+    train, in the frame numbers main_loop keeps in run.fn.
+
+    Each event owns the interval of frames from stage_ahead frames before it
+    up to its frame. main_loop compares run.fn with next_frame once per chunk
+    and only calls update() when it enters or leaves such an interval, so the
+    check costs one comparison however many events there are.
+    '''
+
+    def __init__(self, transitions: Optional[list] = None, latchtrain: Optional[list] = None,
+                 offset: int = 0, stage_ahead: int = 1024) -> None:
+
+        heap = []
+        for frame, mode in transitions or []:
+            heap.append((int(frame) + offset, 0, 'transition', mode))
+        # Latch train entries are consecutive lengths, so each one ends where the next starts
+        end = 0
+        for index, latches in enumerate(latchtrain or []):
+            end += latches
+            heap.append((end + offset, 1, 'train', (index, latches)))
+        heapq.heapify(heap)
+        self.events = [Event(frame, kind, detail) for frame, order, kind, detail in
+                       (heapq.heappop(heap) for _ in range(len(heap)))]
+        self.frames = [event.frame for event in self.events]
+        self.stage_ahead = stage_ahead
+        self.staged = 0
+        self.fired = 0
+        self.next_frame = NEVER
+        self._next()
+
+    def __len__(self) -> int:
+
+        return len(self.events)
+
+    def _next(self) -> None:
+
+        stage = self.frames[self.staged] - self.stage_ahead if self.staged < len(self.frames) else NEVER
+        fire = self.frames[self.fired] + 1 if self.fired < len(self.frames) else NEVER
+        self.next_frame = min(stage, fire)
+
+    def update(self, fn: int) -> tuple:
+
+        #(events now within stage_ahead frames, events whose frame has been sent)
+        #once the frames before fn have been sent
+        staged = []
+        while self.staged < len(self.frames) and self.frames[self.staged] - self.stage_ahead <= fn:
+            staged.append(self.events[self.staged])
+            self.staged += 1
+        fired = []
+        while self.fired < len(self.frames) and self.frames[self.fired] < fn:
+            fired.append(self.events[self.fired])
+            self.fired += 1
+        self._next()
+        return staged, fired
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+import io
+import sys
+import json
+import time
+import zipfile
+import itertools
+import contextlib
+
+from typing import Optional
+
+import argparse_helper
+import serial_helper
+from tastm32 import TAStm32, RunObject, decode_movie, int_buffer
+from schedule import EventSchedule
+
+# Settings a sweep can vary, with the hook.main parameter each one stands for
+AXES = ('blank', 'clock', 'dpcm', 'overread', 'latch_train')
+
+def read_run(path: str) -> tuple:
+
+    #Settings of a .tas file as hook.main parameters, and its movie as stored.
+    #Chunked movies stay chunked, decode_movie reads them a block at a time
+    with zipfile.ZipFile(path) as z:
+        with z.open('run.json') as j:
+            info = json.load(j)
+        if info['movie'] in ('', None):
+            raise RuntimeError('Run has no movie')
+        with z.open(info['movie']) as m:
+            movie = m.read()
+    cso = info['console specific options']
+    transitions = info['transitions'].split(' ') if info['transitions'] != '' else []
+    settings = {
+        'console': info['console'].lower(),
+        'controllers': info['controllers'],
+        # The run stores the clock filter in microseconds, the device counts quarters
+        'clock': int(float(cso['clock filter']) * 4),
+        'dpcm': bool(cso['latch filter']),
+        'overread': bool(cso['overread']),
+        'blank': int(info['blank frames']),
+        'transitions': [[int(transitions[i]), transitions[i + 1].encode()] for i in range(0, len(transitions) - 1, 2)],
+        'latch_train': info['latch train'],
+        'reset': info['initial power setting'],
+        'nobulk': not info['bulk data mode']}
+    return settings, movie
+
+def grid(base: dict, space: dict) -> list:
+
+    #Every combination of the values in space, on top of base
+    names = [name for name in AXES if name in space]
+    return [dict(base, **dict(zip(names, values))) for values in itertools.product(*(space[name] for name in names))]
+
+class Sweep:
+    '''
+    Tries run settings one after another on one TAStm32.
+
+    The serial port stays open and the movie is decoded once, so each attempt
+    only costs the power cycle, the device reset and the buffer prefill.
+    '''
+
+    def __init__(self, dev: TAStm32, settings: dict, movie: bytes, frames: Optional[int] = None,
+                 idle: float = 5.0, verbose: bool = False, log=None) -> None:
+
+        self.dev = dev
+        self.settings = settings
+        self.players = list(map(int, settings['controllers'].split(',')))
+        self.buffer, self.blankframe = decode_movie(settings['console'], movie, self.players)
+        if frames != None:
+            self.buffer = self.buffer[:frames]
+        self.idle = idle
+        self.verbose = verbose
+        self.log = log
+        self.results = []
+
+    def attempt(self, config: dict) -> dict:
+
+        dev = self.dev
+        t0 = time.perf_counter()
+        if config['reset'] in ('hard reset', 'soft reset'):
+            dev.power_off()
+            if config['reset'] == 'hard reset':
+                time.sleep(2.0)
+        # The device forgets every run on reset
+        dev.activeRuns = dict.fromkeys(dev.activeRuns, False)
+        dev.reset()
+        run_id = dev.setup_run(config['console'], self.players, config['dpcm'], config['overread'], config['clock'])
+        for transition in config['transitions']:
+            dev.send_transition(run_id, *transition)
+        for _ in range(config['blank']):
+            dev.write(run_id + self.blankframe)
+        buffer = self.buffer
+        fn = min(int_buffer - config['blank'], len(buffer))
+        for latch in range(fn):
+            dev.write(run_id + buffer[latch])
+        err = dev.read(int_buffer)
+        fn -= err.count(b'\xB0')
+        latchtrain = [int(x) for x in config['latch_train'].split(',')] if config['latch_train'] != '' else []
+        if latchtrain != []:
+            dev.send_latchtrain(run_id, latchtrain)
+        run = RunObject(run_id, buffer, fn, self.blankframe,
+                        schedule = EventSchedule(config['transitions'], latchtrain),
+                        idle_timeout = self.idle, buffered = config['blank'] + fn)
+        if not config['nobulk']:
+            dev.set_bulk_data_mode(run_id, b'1')
+        setup = time.perf_counter() - t0
+        dev.power_on()
+        out = sys.stdout if self.verbose else io.StringIO()
+        with contextlib.redirect_stdout(out):
+            try:
+                dev.main_loop(run)
+            except SystemExit:
+                # A failed latch train ends the attempt, not the sweep
+                pass
+        reached = min(run.fn, len(buffer))
+        result = {name: config[name] for name in AXES}
+        result.update(run.stats.as_dict())
+        result['frames reached'] = reached
+        result['setup seconds'] = round(setup, 3)
+        result['seconds'] = round(time.perf_counter() - t0, 3)
+        result['success'] = (reached >= len(buffer) and run.stats.train_failed == 0 and
+                             run.stats.train_success >= len(latchtrain))
+        self.results.append(result)
+        if self.log != None:
+            self.log.write(json.dumps(result) + '\n')
+            self.log.flush()
+        print(' '.join(f'{name}={result[name]!r}' for name in AXES),
+              f"-> {'OK' if result['success'] else 'FAILED'}: {reached}/{len(buffer)} frames,",
+              f"{result['overflows']} overflows, trains {result['train_success']} ok / {result['train_failed']} failed",
+              f"(setup {setup:.2f} s)")
+        return result
+
+    def run_grid(self, configs: list) -> list:
+
+        return [self.attempt(config) for config in configs]
+
+    def run_bisect(self, configs: list, axis: str, low: int, high: int) -> list:
+
+        #Smallest value of axis in low .. high that succeeds, for each config,
+        #assuming every value above a successful one succeeds too
+        found = []
+        for config in configs:
+            lo, hi = low, high + 1
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self.attempt(dict(config, **{axis: mid}))['success']:
+                    hi = mid
+                else:
+                    lo = mid + 1
+            found.append((config, lo if lo <= high else None))
+        return found
+
+def parse_values(text: str, kind) -> list:
+
+    if kind == str:
+        return text.split(';')
+    if kind == bool:
+        return [value.strip() not in ('0', 'false', 'False', '') for value in text.split(',')]
+    return [kind(value) for value in text.split(',')]
+
+def main():
+    parser = argparse_helper.sweep_parser()
+    args = parser.parse_args()
+
+    settings, movie = read_run(args.run)
+    if args.reset != None:
+        settings['reset'] = args.reset
+    kinds = {'blank': int, 'clock': int, 'dpcm': bool, 'overread': bool, 'latch_train': str}
+    space = {}
+    for axis in AXES:
+        value = getattr(args, axis)
+        if value != None:
+            space[axis] = parse_values(value, kinds[axis])
+    if args.bisect != None:
+        if args.bisect not in space or len(space[args.bisect]) != 2:
+            parser.error(f'--bisect {args.bisect} needs --{args.bisect} LOW,HIGH')
+        low, high = space.pop(args.bisect)
+
+    dev = TAStm32(args.serial if args.serial != None else serial_helper.select_serial_port())
+    log = open(args.log, 'a') if args.log != None else None
+    sweep = Sweep(dev, settings, movie, args.frames, args.idle, args.verbose, log)
+    configs = grid(settings, space)
+    print(f'{len(configs)} configurations' + (f', bisecting {args.bisect} in {low}..{high}' if args.bisect else ''))
+    t0 = time.perf_counter()
+    try:
+        if args.bisect != None:
+            for config, value in sweep.run_bisect(configs, args.bisect, low, high):
+                fixed = ' '.join(f'{name}={config[name]!r}' for name in AXES if name != args.bisect)
+                print(f'{fixed}: ' + (f'smallest working {args.bisect} is {value}' if value != None else 'nothing works'))
+        else:
+            sweep.run_grid(configs)
+    except KeyboardInterrupt:
+        print('^C Stopping the sweep')
+    finally:
+        if log != None:
+            log.close()
+        dev.ser.close()
+    working = [result for result in sweep.results if result['success']]
+    print(f'{len(sweep.results)} attempts in {time.perf_counter() - t0:.1f} s, {len(working)} succeeded')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import hashlib
+import pathlib
+import zipfile
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Optional
+
+import argparse_helper
+import chunked
+import consoles
+import metadata
+import worker
+
+# tasfile.py's defaults for everything a manifest entry leaves out
+DEFAULTS = {
+    "name": "",
+    "authors": "",
+    "description": "",
+    "console specific options": {
+        "latch filter": False,
+        "clock filter": 0.0,
+        "overread": False},
+    "blank frames": 0,
+    "initial power setting": "none",
+    "bulk data mode": True,
+    "transitions": "",
+    "latch train": ""}
+
+COPY_BYTES = 1 << 20
+
+def console_for(path: str) -> str:
+
+    return consoles.for_extension(pathlib.Path(path).suffix).name
+
+def controllers_for(console: str, info: metadata.MovieInfo) -> str:
+
+    #Every port the movie has input for that the TAStm32 can play, as tasfile.py writes them
+    fmt = consoles.get(console)
+    if not fmt.takes_players:
+        return "1"
+    #Only movies with a layout header say which controllers they use
+    ports = [port for port in fmt.players if port <= info.controllers] if fmt.header_layout != None else []
+    return ",".join(map(str, ports or fmt.players[:1]))
+
+def build(job: dict) -> dict:
+    '''
+    Write one .tas file. job holds "movie" and "output" paths, "run" (the
+    run.json fields), and the builder options "compress", "frame count",
+    "hash" and "compiled".
+
+    The movie is copied into the zip in pieces, so no more than one piece, or
+    one block when compressing, is in memory at once. Only "compiled" needs
+    the whole movie, because the stream is built from the decoded frames.
+    '''
+
+    t0 = time.perf_counter()
+    movie = job["movie"]
+    run = dict(DEFAULTS, **job["run"])
+    run["console specific options"] = dict(DEFAULTS["console specific options"],
+                                           **run["console specific options"])
+    console = consoles.get(run["console"]).name
+    info = metadata.read_metadata(movie, fmt = consoles.get(console).extension)
+    run.setdefault("controllers", controllers_for(console, info))
+    member = pathlib.Path(movie).name
+    run["movie"] = member
+    run["movie format"] = "chunked" if job["compress"] else "raw"
+    run["version"] = "1.2"
+    if job["frame count"]:
+        run["frame count"] = info.frame_count
+    size = os.path.getsize(movie)
+    digest = hashlib.sha256() if job["hash"] else None
+
+    output = pathlib.Path(job["output"])
+    output.parent.mkdir(parents = True, exist_ok = True)
+    temp = output.with_name(output.name + ".part")
+    try:
+        write(temp, movie, member, size, console, run, job, digest)
+    except BaseException:
+        temp.unlink(missing_ok = True)
+        raise
+    os.replace(temp, output)
+    return {"movie": movie, "output": str(output), "frames": info.frame_count,
+            "seconds": time.perf_counter() - t0}
+
+def write(temp: pathlib.Path, movie: str, member: str, size: int, console: str, run: dict, job: dict, digest) -> None:
+
+    with zipfile.ZipFile(temp, "w") as z:
+        #Entries that might pass 2 GiB have to say so before they are written
+        with open(movie, "rb") as src, z.open(member, "w", force_zip64 = size > 1 << 30) as dst:
+            if job["compress"]:
+                start, stride = chunked.layout(console, src.read(consoles.get(console).header_size))
+                src.seek(0)
+                chunked.pack_file(src, dst, size, start, stride, digest = digest)
+            else:
+                while True:
+                    piece = src.read(COPY_BYTES)
+                    if piece == b"":
+                        break
+                    if digest != None:
+                        digest.update(piece)
+                    dst.write(piece)
+        if digest != None:
+            run["movie sha256"] = digest.hexdigest()
+        if job["compiled"]:
+            #The stream tastm32.py plays without decoding, for the first run slot
+            import tascompile
+            with open(movie, "rb") as src:
+                data = src.read()
+            cso = run["console specific options"]
+            players = list(map(int, run["controllers"].split(",")))
+            stream = tascompile.compile_movie(data, console, players, int(run["blank frames"]), b"A",
+                                              bool(cso["latch filter"]), bool(cso["overread"]),
+                                              int(float(cso["clock filter"]) * 4))
+            run["compiled stream"] = member + ".tstm"
+            z.writestr(run["compiled stream"], stream)
+        #run.json goes last so it can describe what was written before it
+        z.writestr("run.json", json.dumps(run))
+
+def read_manifest(path: str) -> list:
+
+    #A list of entries, or {"defaults": {...}, "runs": [...]}. Each entry is
+    #run.json fields plus "movie" and optionally "output", with paths relative
+    #to the manifest
+    with open(path) as f:
+        manifest = json.load(f)
+    if isinstance(manifest, list):
+        manifest = {"runs": manifest}
+    base = pathlib.Path(path).parent
+    entries = []
+    for entry in manifest["runs"]:
+        entry = dict(manifest.get("defaults", {}), **entry)
+        entry["movie"] = str(base / entry["movie"])
+        if "output" in entry:
+            entry["output"] = str(base / entry["output"])
+        entries.append(entry)
+    return entries
+
+def scan(directory: str) -> list:
+
+    #Every movie under directory, with nothing but the movie set
+    extensions = {console.extension for console in consoles.CONSOLES.values()}
+    return [{"movie": str(p)} for p in sorted(pathlib.Path(directory).rglob("*"))
+            if p.is_file() and p.suffix.lower().lstrip(".") in extensions]
+
+def plan(entries: list, root: str, output: Optional[str], options: dict) -> list:
+
+    jobs = []
+    for entry in entries:
+        entry = dict(entry)
+        movie = entry.pop("movie")
+        target = entry.pop("output", None)
+        if target == None:
+            path = pathlib.Path(movie)
+            if output != None:
+                #Mirror the layout of the input under the output directory
+                try:
+                    relative = path.relative_to(root)
+                except ValueError:
+                    relative = pathlib.Path(path.name)
+                path = pathlib.Path(output) / relative
+            target = str(path.with_suffix(".tas"))
+        if "console" not in entry:
+            entry["console"] = console_for(movie)
+        entry["console"] = consoles.get(entry["console"]).run_name
+        jobs.append(dict(options, movie = movie, output = target, run = entry))
+    return jobs
+
+def main():
+    parser = argparse_helper.build_parser()
+    args = parser.parse_args()
+
+    if os.path.isdir(args.source):
+        root = args.source
+        entries = scan(args.source)
+    else:
+        root = str(pathlib.Path(args.source).parent)
+        entries = read_manifest(args.source)
+    options = {"compress": not args.raw, "frame count": args.frame_count, "hash": args.hash,
+               "compiled": args.compiled}
+    try:
+        jobs = plan(entries, root, args.output, options)
+    except RuntimeError as e:
+        print(f'ERROR: {e}')
+        sys.exit(1)
+    if not args.force:
+        skipped = [job for job in jobs if os.path.exists(job["output"])]
+        jobs = [job for job in jobs if not os.path.exists(job["output"])]
+        if skipped:
+            print(f'Skipping {len(skipped)} runs that already exist (--force rebuilds them)')
+
+    workers = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    t0 = time.perf_counter()
+    failed = 0
+    with ProcessPoolExecutor(max(1, min(workers, len(jobs))), mp_context = worker.getContext()) as pool:
+        futures = {pool.submit(build, job): job for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                result = future.result()
+                print(f'{result["output"]}: {result["frames"]} frames in {result["seconds"]:.2f} s')
+            except Exception as e:
+                failed += 1
+                print(f'{job["movie"]}: FAILED {e}')
+    print(f'{len(jobs) - failed} of {len(jobs)} runs built in {time.perf_counter() - t0:.1f} s')
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
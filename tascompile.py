@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+import sys
+import mmap
+import struct
+import hashlib
+
+import argparse_helper
+from tastm32 import decode_movie, setup_bytes, latches_per_bulk_command
+
+# A compiled stream is a small header followed by the exact latch packets
+# (run prefix + frame) main_loop sends: the blank frames, the movie, and blank
+# padding up to a whole bulk command.
+MAGIC = b'TSTM'
+VERSION = 1
+header_struct = struct.Struct('<4sHcBBBcxIII32s')
+HEADER_SIZE = 64
+
+STAGE_BYTES = 1 << 20
+
+def is_stream(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def compile_movie(data, console, players, blank=0, prefix=b'A', dpcm=False, overread=False, clock_filter=0):
+    cbyte, pbyte, sbyte = setup_bytes(console, players, dpcm, overread, clock_filter)
+    buffer, blankframe = decode_movie(console, data, players)
+    stride = len(prefix) + buffer.stride
+    padding = -(blank + len(buffer)) % latches_per_bulk_command
+    payload = bytearray((blank + len(buffer) + padding) * stride)
+    blankpacket = prefix + b'\x00' * buffer.stride
+    payload[:blank * stride] = blankpacket * blank
+    buffer.pack(payload, blank * stride, prefix, 0, len(buffer))
+    payload[(blank + len(buffer)) * stride:] = blankpacket * padding
+    digest = hashlib.sha256(payload).digest()
+    header = header_struct.pack(MAGIC, VERSION, cbyte, pbyte, sbyte, stride, prefix,
+                                blank, len(buffer), padding, digest)
+    return header.ljust(HEADER_SIZE, b'\x00') + payload
+
+class CompiledStream:
+    '''
+    Memory-mapped compiled stream. Offers the same read() as FrameRing so
+    main_loop can send straight from the file with no decoding.
+    '''
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.console, self.players, self.settings, self.stride, self.prefix,
+         self.blank_count, self.frame_count, self.padding, self.digest) = header_struct.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise RuntimeError('Bad stream magic')
+        if version != VERSION:
+            raise RuntimeError('Unsupported stream version {}'.format(version))
+        self.view = memoryview(self.map)[HEADER_SIZE:]
+        self.length = len(self.view) // self.stride
+        if self.length != self.blank_count + self.frame_count + self.padding:
+            raise RuntimeError('Stream is truncated')
+        self.blank = self.prefix + b'\x00' * (self.stride - len(self.prefix))
+
+    def __len__(self):
+        return self.length
+
+    def verify(self):
+        return hashlib.sha256(self.view).digest() == self.digest
+
+    def start(self):
+        return self
+
+    def stop(self):
+        pass
+
+    def stage(self, stop):
+        # Ask the OS to page in the next stretch of the file ahead of time
+        if hasattr(self.map, 'madvise'):
+            start = HEADER_SIZE + min(stop, self.length) * self.stride
+            begin = max(0, start - STAGE_BYTES) // mmap.PAGESIZE * mmap.PAGESIZE
+            if start > begin:
+                self.map.madvise(mmap.MADV_WILLNEED, begin, start - begin)
+
+    def read(self, fn, count):
+        if fn < 0:
+            count += fn
+            fn = 0
+        avail = max(0, min(count, self.length - fn))
+        data = self.view[fn * self.stride:(fn + avail) * self.stride].tobytes()
+        if avail < count:
+            data += self.blank * (count - avail)
+        return data
+
+    def close(self):
+        self.view.release()
+        self.map.close()
+        self.file.close()
+
+def main():
+    parser = argparse_helper.compile_parser()
+    args = parser.parse_args()
+
+    if args.verify:
+        stream = CompiledStream(args.movie)
+        print(f'Console: {stream.console.decode()}, players: {stream.players:#04x}, settings: {stream.settings:#04x}')
+        print(f'Blank frames: {stream.blank_count}, movie frames: {stream.frame_count}, padding: {stream.padding}')
+        ok = stream.verify()
+        print(f'SHA-256: {stream.digest.hex()} {"OK" if ok else "MISMATCH"}')
+        stream.close()
+        sys.exit(0 if ok else 1)
+
+    if args.console == None:
+        parser.error('--console is required when compiling')
+    players = [int(x) for x in args.players.split(',')]
+    clock = 0
+    if args.clock != None:
+        clock = int(args.clock)
+        if clock < 0 or clock > 63:
+            print('ERROR: The clock value must be in the range [0,63]! Exiting.')
+            sys.exit(0)
+    try:
+        with open(args.movie, 'rb') as f:
+            data = f.read()
+    except:
+        print('ERROR: the specified file (' + args.movie + ') failed to open')
+        sys.exit(0)
+    compiled = compile_movie(data, args.console, players, args.blank, args.prefix.encode(),
+                             args.dpcm, args.overread, clock)
+    output = args.output if args.output != None else args.movie + '.tstm'
+    with open(output, 'wb') as f:
+        f.write(compiled)
+    print(f'Wrote {output}: SHA-256 {hashlib.sha256(compiled[HEADER_SIZE:]).hexdigest()}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+import json
+import sys
+import time
+import hashlib
+import pathlib
+import zipfile
+
+from typing import Optional
+
+import argparse_helper
+import chunked
+import consoles
+from framebuffer import FrameBuffer
+
+DIGEST_SIZE = 16
+
+# _BITS[b] maps a byte to 1 if bit b (counted from the most significant) is set
+_BITS = [bytes((v >> (7 - b)) & 1 for v in range(256)) for b in range(8)]
+
+def load(path: str, console: Optional[str] = None, players: Optional[list] = None) -> tuple:
+    '''
+    Decode a movie or the movie of a .tas file into a FrameBuffer.
+
+    .tas files bring their own console and players. For raw movies the console
+    is taken from the file extension unless given.
+    Returns (console, players, frames).
+    '''
+
+    suffix = pathlib.Path(path).suffix.lower().lstrip('.')
+    if suffix in ('tas', 'zip'):
+        with zipfile.ZipFile(path) as z:
+            with z.open('run.json') as j:
+                run = json.load(j)
+            if run['movie'] in ('', None):
+                raise RuntimeError('Run has no movie')
+            with z.open(run['movie']) as m:
+                data = chunked.unpack(m.read())
+        fmt = consoles.get(run['console'])
+        players = [int(x) for x in run['controllers'].split(',') if x != '']
+    else:
+        if console == None:
+            matches = [c for c in consoles.CONSOLES.values() if c.extension == suffix]
+            if len(matches) != 1:
+                raise RuntimeError('Cannot tell the console of {}'.format(path))
+            fmt = matches[0]
+        else:
+            fmt = consoles.get(console)
+        if players == None:
+            players = [1]
+        with open(path, 'rb') as f:
+            data = f.read()
+    frames = FrameBuffer.from_frames(fmt.decode(data, players), fmt.frame_size * len(players))
+    if not fmt.takes_players:
+        #The decoder keeps every controller the movie has
+        players = list(range(1, frames.stride // fmt.frame_size + 1))
+    return fmt.name, players, frames
+
+class BlockIndex:
+    '''
+    Hash tree over fixed size blocks of frames.
+
+    levels[0] holds one digest per block, every level above one digest per
+    pair of the level below, so two movies can be compared from the root down
+    and the first differing block is found after O(log n) digest comparisons.
+    '''
+
+    __slots__ = ('frames', 'block', 'levels')
+
+    def __init__(self, frames: FrameBuffer, block: int = 4096) -> None:
+
+        self.frames = frames
+        self.block = block
+        stride = frames.stride
+        view = frames.frames(0, len(frames))
+        size = block * stride
+        level = [hashlib.blake2b(view[i:i + size], digest_size = DIGEST_SIZE).digest()
+                 for i in range(0, len(view), size)]
+        self.levels = [level]
+        while len(level) > 1:
+            level = [hashlib.blake2b(b''.join(level[i:i + 2]), digest_size = DIGEST_SIZE).digest()
+                     for i in range(0, len(level), 2)]
+            self.levels.append(level)
+
+    def first_block(self, other: 'BlockIndex', count: int) -> Optional[int]:
+
+        #First block among the first count blocks whose digests differ
+        top = max(len(self.levels), len(other.levels)) - 1
+        return self._search(other, top, 0, count)
+
+    def _search(self, other: 'BlockIndex', depth: int, node: int, count: int) -> Optional[int]:
+
+        span = 1 << depth
+        if node * span >= count:
+            return None
+        #Only nodes made entirely of full common blocks hash the same frames in both trees
+        if (node + 1) * span <= count and self.levels[depth][node] == other.levels[depth][node]:
+            return None
+        if depth == 0:
+            return node
+        first = self._search(other, depth - 1, node * 2, count)
+        if first == None:
+            first = self._search(other, depth - 1, node * 2 + 1, count)
+        return first
+
+    def differing_blocks(self, other: 'BlockIndex', count: int) -> list:
+
+        mine = self.levels[0]
+        theirs = other.levels[0]
+        return [i for i in range(count) if mine[i] != theirs[i]]
+
+def _first_nonzero(data: bytes) -> int:
+
+    return len(data) - len(data.lstrip(b'\x00'))
+
+class Diff:
+    '''
+    Every difference between two decoded movies, counted per frame, per
+    player and per button.
+    '''
+
+    def __init__(self, old: FrameBuffer, new: FrameBuffer, fmt: consoles.ConsoleFormat,
+                 players: list, block: int = 4096, limit: int = 10) -> None:
+
+        if old.stride != new.stride:
+            raise RuntimeError('Movies have different frame sizes ({} and {} bytes)'.format(old.stride, new.stride))
+        self.fmt = fmt
+        self.players = players
+        self.old_length = len(old)
+        self.new_length = len(new)
+        common = min(len(old), len(new))
+        stride = old.stride
+        size = fmt.frame_size
+        old_index = BlockIndex(old, block)
+        new_index = BlockIndex(new, block)
+        #Blocks past the shorter movie are never compared
+        count = common // block
+        first = old_index.first_block(new_index, count)
+        self.first = None
+        if first != None:
+            a = old.frames(first * block, (first + 1) * block).tobytes()
+            b = new.frames(first * block, (first + 1) * block).tobytes()
+            xor = (int.from_bytes(a, 'little') ^ int.from_bytes(b, 'little')).to_bytes(len(a), 'little')
+            self.first = first * block + _first_nonzero(xor) // stride
+        blocks = old_index.differing_blocks(new_index, count) if first != None else []
+        if count * block < common:
+            blocks.append(count)
+
+        self.frames = 0
+        self.listed = []
+        self.per_player = [0] * len(players)
+        self.per_button = [[0] * (8 if isinstance(names, tuple) else 1) for names in fmt.buttons * len(players)]
+        for i in blocks:
+            start = i * block
+            stop = min(start + block, common)
+            a = old.frames(start, stop).tobytes()
+            b = new.frames(start, stop).tobytes()
+            if a == b:
+                continue
+            n = stop - start
+            xor = (int.from_bytes(a, 'little') ^ int.from_bytes(b, 'little')).to_bytes(len(a), 'little')
+            changed = 0
+            for p in range(len(players)):
+                player = 0
+                for k in range(size):
+                    column = p * size + k
+                    bits = xor[column::stride]
+                    player |= int.from_bytes(bits, 'little')
+                    counts = self.per_button[column]
+                    if len(counts) == 1:
+                        counts[0] += n - bits.count(0)
+                    else:
+                        for bit in range(8):
+                            counts[bit] += bits.translate(_BITS[bit]).count(1)
+                changed |= player
+                self.per_player[p] += n - player.to_bytes(n, 'little').count(0)
+            changed = changed.to_bytes(n, 'little')
+            self.frames += n - changed.count(0)
+            if self.first == None:
+                #Only the partial block after the last full one differs
+                self.first = start + _first_nonzero(changed)
+            f = _first_nonzero(changed)
+            while f < n and len(self.listed) < limit:
+                frame = start + f
+                self.listed.append((frame, old[frame], new[frame]))
+                f += 1 + _first_nonzero(changed[f + 1:])
+
+    def report(self) -> str:
+
+        fmt = self.fmt
+        size = fmt.frame_size
+        lines = []
+        if self.first == None and self.old_length == self.new_length:
+            return 'Inputs are identical ({} frames)'.format(self.old_length)
+        if self.first != None:
+            lines.append('First difference at frame {}'.format(self.first))
+            lines.append('{} of {} common frames differ'.format(self.frames, min(self.old_length, self.new_length)))
+        else:
+            lines.append('Common frames are identical')
+        if self.old_length != self.new_length:
+            lines.append('Lengths differ: {} and {} frames'.format(self.old_length, self.new_length))
+        for p, player in enumerate(self.players):
+            if self.per_player[p] == 0:
+                continue
+            lines.append('Player {}: {} frames'.format(player, self.per_player[p]))
+            for k, names in enumerate(fmt.buttons):
+                counts = self.per_button[p * size + k]
+                if isinstance(names, str):
+                    if counts[0]:
+                        lines.append('  {}: {}'.format(names, counts[0]))
+                    continue
+                for bit, name in enumerate(names):
+                    if counts[bit]:
+                        lines.append('  {}: {}'.format(name or 'Bit {}'.format(8 * k + 7 - bit), counts[bit]))
+        for frame, a, b in self.listed:
+            old = [' '.join(fmt.pressed(a[p * size:(p + 1) * size])) for p in range(len(self.players))]
+            new = [' '.join(fmt.pressed(b[p * size:(p + 1) * size])) for p in range(len(self.players))]
+            lines.append('{:>9}: {} -> {}'.format(frame, ' | '.join(old), ' | '.join(new)))
+        return '\n'.join(lines)
+
+def main():
+    parser = argparse_helper.diff_parser()
+    args = parser.parse_args()
+    players = [int(x) for x in args.players.split(',')]
+
+    t0 = time.perf_counter()
+    old_console, old_players, old = load(args.old, args.console, players)
+    new_console, new_players, new = load(args.new, args.console, players)
+    if old_console != new_console or old_players != new_players:
+        print(f'ERROR: {args.old} is {old_console} players {old_players}, {args.new} is {new_console} players {new_players}')
+        sys.exit(2)
+    t1 = time.perf_counter()
+    diff = Diff(old, new, consoles.get(old_console), old_players, args.block, args.limit)
+    t2 = time.perf_counter()
+    print(diff.report())
+    print(f'Decoded in {t1 - t0:.3f} s, compared in {t2 - t1:.3f} s')
+    sys.exit(0 if diff.first == None and diff.old_length == diff.new_length else 1)
+
+if __name__ == '__main__':
+    main()
@@ -12,6 +12,7 @@ from tkinter.scrolledtext import ScrolledText
 from multiprocessing import Process
 
 from widgets import ControllerSelector, TransitionsTable
+import chunked
 
 def makeStackedFrame(parent):
 
@@ -220,6 +221,19 @@ class App(tk.Tk):
         self.movie_scrollbar.grid(row = 2, column = 0, sticky = tk.E + tk.W)
         self.movie_frame.pack(fill = "x")
 
+        #Compress Movie
+        self.compress_frame = makeDuoFrame(self.right)
+        label = tk.Label(self.compress_frame,
+                         text = "Compress Movie")
+        label.grid(row = 0, column = 0, sticky = tk.E + tk.W)
+        self.compress = tk.BooleanVar(self, value = True)
+        self.compress_checkbutton = tk.Checkbutton(self.compress_frame,
+                                                   onvalue = True,
+                                                   offvalue = False,
+                                                   variable = self.compress)
+        self.compress_checkbutton.grid(row = 0, column = 1, sticky = tk.E + tk.W)
+        self.compress_frame.pack(fill = "x")
+
         #Write Button
         self.write_button = tk.Button(self,
                                       text = "Write TAS file",
@@ -291,11 +305,19 @@ class App(tk.Tk):
             "transitions": self.transitionsTable.get(),
             "latch train": self.train.get(),
             "movie": path,
-            "version": "1.1"}
+            "movie format": "raw",
+            "version": "1.2"}
+        movie = self.movie
+        if path != None and self.compress.get() == True:
+            #Independently compressed blocks keep any frame reachable without
+            #inflating the whole movie
+            start, stride = chunked.layout(self.console.get(), movie)
+            movie = chunked.pack(movie, start, stride)
+            data["movie format"] = "chunked"
         with zipfile.ZipFile(file, "w") as z:
             z.writestr("run.json", json.dumps(data))
             if path != None:
-                z.writestr(path, self.movie)
+                z.writestr(path, movie)
             
             
 
@@ -330,7 +352,8 @@ class App(tk.Tk):
                 self.train.set(data["latch train"])
                 self.movie_name.set(data["movie"])
             with z.open(self.movie_name.get(), "r") as m:
-                self.movie = m.read()
+                self.movie = chunked.unpack(m.read())
+            self.compress.set(data.get("movie format", "raw") == "chunked")
 
     def openMovie(self):
         self.movie_name.set(
@@ -10,7 +10,12 @@ import psutil
 import serial_helper
 import argparse_helper
 
-import r08, r16m, m64, dtm, rgen
+import chunked
+import consoles
+from framering import FrameRing
+from framebuffer import BlockFrames, FrameBuffer, compact
+from schedule import EventSchedule
+from timing import StageTrace, profiled
 
 DEBUG = False
 
@@ -19,18 +24,54 @@ int_buffer = 1024 # internal buffer size on replay device
 latches_per_bulk_command = 28
 packets = 4
 
-VALID_PLAYERS = {
-    "n64": (1,2,),
-    "snes": (1,2,3,4,5,6,7,8,),
-    "nes": (1,5,),
-    "gc": (1,),
-    "genesis": (1,5,)
-}
+VALID_PLAYERS = consoles.valid_players()
 
 int_to_byte_struct = struct.Struct('B')
 def int_to_byte(interger):
     return int_to_byte_struct.pack(interger)
 
+def seek_transitions(transitions, start):
+    # Transitions are counted from the first frame sent, so shift them by the
+    # start frame and drop the ones that would already have happened
+    if transitions == None or start == 0:
+        return transitions
+    return [[frame - start, mode] for frame, mode in transitions if frame >= start]
+
+def seek_latchtrain(latchtrain, start):
+    # Each latch train entry consumes that many frames of the movie. Drop the
+    # trains that end before the start frame and shorten one that straddles it
+    if start == 0:
+        return latchtrain
+    end = 0
+    for index, latches in enumerate(latchtrain):
+        end += latches
+        if end > start:
+            return [end - start] + latchtrain[index + 1:]
+    return []
+
+def setup_bytes(console, players=[1], dpcm=False, overread=False, clock_filter=0):
+    # Console, player and settings bytes of the run setup command
+    return consoles.get(console).setup_bytes(players, dpcm, overread, clock_filter)
+
+def decode_movie(console, data, players, header=None, jobs=1):
+    # Decoded frames and the blank frame to pad them with. header is an already
+    # parsed movie header for formats that have one. jobs other than 1 lets long
+    # movies be decoded by that many processes (0 for one per core). Chunked
+    # movies are decoded a block at a time while the replay reaches them
+    fmt = consoles.get(console)
+    blankframe = fmt.blankframe(players)
+    if chunked.is_chunked(data):
+        movie = chunked.ChunkedMovie(data)
+        decode = lambda raw: fmt.decode(movie.header + raw, players, header)
+        return BlockFrames(movie, decode, len(blankframe)), blankframe
+    if jobs != 1:
+        import parallel
+        buffer = parallel.decode(console, data, players, header, workers=jobs)
+    else:
+        buffer = fmt.decode(data, players, header)
+    # Movies with long idle stretches are kept run-length encoded
+    return compact(FrameBuffer.from_frames(buffer, len(blankframe))), blankframe
+
 class TAStm32():
     def __init__(self, ser):
         att = 0
@@ -45,8 +86,26 @@ class TAStm32():
         if self.ser == None:
             print ('ERROR: the specified interface (' + ser + ') is in use')
             sys.exit(0)
-        else:
-            self.activeRuns = {b'A': False, b'B': False, b'C': False, b'D': False}
+        self._attach(self.ser, att + 1)
+
+    @classmethod
+    def from_serial(cls, ser):
+        # A TAStm32 talking through an already open serial object, or anything
+        # with its read/write/inWaiting, e.g. to replay captures or benchmark
+        dev = cls.__new__(cls)
+        dev._attach(ser, 0)
+        return dev
+
+    def _attach(self, ser, attempts):
+        self.ser = ser
+        self.activeRuns = {b'A': False, b'B': False, b'C': False, b'D': False}
+        self.open_attempts = attempts
+        # Optional capture.CaptureLog of everything sent and received
+        self.capture = None
+        # Optional cursor.FrameCursor main_loop publishes its frame number to
+        self.cursor = None
+        # Optional metrics.Metrics that times every write
+        self.metrics = None
 
     def get_run_prefix(self):
         if self.activeRuns[b'A']:
@@ -68,13 +127,22 @@ class TAStm32():
             return b'A'
 
     def write(self, data):
-        count = self.ser.write(data)
+        if self.metrics != None:
+            t0 = time.perf_counter()
+            count = self.ser.write(data)
+            self.metrics.write_time(time.perf_counter() - t0)
+        else:
+            count = self.ser.write(data)
+        if self.capture != None:
+            self.capture.record(b'S', data)
         if DEBUG and data != b'':
             print('S:', data)
         return count
 
     def read(self, count):
         data = self.ser.read(count)
+        if self.capture != None and data != b'':
+            self.capture.record(b'R', data)
         if DEBUG and data != b'':
             print('R:', data)
         return data
@@ -135,72 +203,10 @@ class TAStm32():
             self.write(command)
 
     def setup_run(self, console, players=[1], dpcm=False, overread=False, clock_filter=0):
+        cbyte, pbyte, sbyte = setup_bytes(console, players, dpcm, overread, clock_filter)
         prefix = self.get_run_prefix()
         if prefix == None:
             raise RuntimeError('No Free Run')
-        vp = VALID_PLAYERS.get(console, ())
-        if console == 'n64':
-            cbyte = b'M'
-            pbyte = 0
-            for player in players:
-                p = int(player)
-                if p in vp:
-                    pbyte = pbyte ^ 2**(8-p)
-                else:
-                    raise RuntimeError('Invalid player for N64')
-            sbyte = 0
-        elif console == 'snes':
-            cbyte = b'S'
-            pbyte = 0
-            for player in players:
-                p = int(player)
-                if p in vp:
-                    pbyte = pbyte ^ 2**(8-p)
-                else:
-                    raise RuntimeError('Invalid player for SNES')
-            sbyte = 0
-            if dpcm:
-                sbyte = sbyte ^ 0x80
-            if overread:
-                sbyte = sbyte ^ 0x40
-            if clock_filter:
-                sbyte = sbyte + clock_filter
-        elif console == 'nes':
-            cbyte = b'N'
-            pbyte = 0
-            for player in players:
-                p = int(player)
-                if p in vp:
-                    pbyte = pbyte ^ 2**(8-p)
-                else:
-                    raise RuntimeError('Invalid player for NES')
-            sbyte = 0
-            if dpcm:
-                sbyte = sbyte ^ 0x80
-            if overread:
-                sbyte = sbyte ^ 0x40
-            if clock_filter:
-                sbyte = sbyte + clock_filter
-        elif console == 'gc':
-            cbyte = b'G'
-            pbyte = 0
-            for player in players:
-                p = int(player)
-                if p in vp:
-                    pbyte = pbyte ^ 2**(8-p)
-                else:
-                    raise RuntimeError('Invalid player for GC')
-            sbyte = 0
-        elif console == 'genesis':
-            cbyte = b'J'
-            pbyte = 0
-            sbyte = 0
-            for player in players:
-                p = int(player)
-                if p in vp:
-                    pbyte = pbyte ^ 2**(8-p)
-                else:
-                    raise RuntimeError('Invalid player for Genesis')
         command = b'S' + prefix + cbyte + int_to_byte(pbyte) + int_to_byte(sbyte)
         self.write(command)
         time.sleep(0.1)
@@ -214,82 +220,242 @@ class TAStm32():
     def main_loop(self, run):
         global DEBUG
         frame = 0
-        frame_max = len(run.buffer)
-        while True:
-            try:
-                c = self.read(1)
-                if c == '':
-                    continue
-                numBytes = self.ser.inWaiting()
-                if numBytes > 0:
-                    c += self.read(numBytes)
-                    if numBytes > int_buffer:
-                        print ("WARNING: High latch rate detected: " + str(numBytes))
-                latches = c.count(run.run_id)
-                bulk = c.count(run.run_id.lower())
-                missed = c.count(b'\xB0')
-                if missed != 0:
-                    run.fn -= missed
-                    print('Buffer Overflow x{}'.format(missed))
-
-                # Latch Trains
-                trainskips = c.count(b'UA')
-                if trainskips != 0:
-                    print(f'--- Extra frame detected. Skipping a frame to compensate. x{trainskips}')
-                trainextra = c.count(b'UB')
-                if trainextra != 0:
-                    print(f'--- Short a frame. Adding a frame to compensate. x{trainextra}')
-                trainfin = c.count(b'UC')
-                if trainfin != 0:
-                    print(f'+++ Latch train success! x{trainfin}')
-                trainfailed = c.count(b'UF')
-                if trainfailed != 0:
-                    print(f'!!! Off by many frames. Run is probably broken. Good luck! x{trainfailed}')
-                    sys.exit(1)
-
-                for latch in range(latches):
-                    try:
-                        data = run.run_id + run.buffer[run.fn]
-                        self.write(data)
-                        if run.fn % 100 == 0:
-                            print('Sending Latch: {}'.format(run.fn))
-                    except IndexError:
-                        pass
-                    run.fn += 1
-                    frame += 1
-                for cmd in range(bulk):
-                    for packet in range(packets):
-                        command = []
-                        for latch in range(latches_per_bulk_command//packets):
-                            try:
-                                command.append(run.run_id + run.buffer[run.fn])
-                                run.fn += 1
-                                if run.fn % 100 == 0:
-                                    print('Sending Latch: {}'.format(run.fn))
-                            except IndexError:
-                                command.append(run.run_id + run.blankframe)
-                                run.fn += 1
-                            frame += 1
-                        data = b''.join(command)
-                        self.write(data)
-                    self.write(run.run_id.lower())
-                if frame > frame_max:
+        frame_max = run.length
+        stride = run.ring.stride
+        per_packet = latches_per_bulk_command//packets
+        cursor = self.cursor
+        schedule = run.schedule
+        next_event = schedule.next_frame if schedule != None else sys.maxsize
+        stats = run.stats
+        # Estimate of the frames waiting in the device, for the metrics only: every
+        # frame sent adds one, every latch takes one, a \xB0 means it was full and
+        # bulk requests mean there was room for all the frames they ask for. It is
+        # reported as it was when the device was heard from, before the answer, so
+        # latches and requests piling up while the host lags show as a drop
+        level = run.buffered
+        stats.buffer_level = stats.buffer_low = level
+        idle_timeout = run.idle_timeout
+        idle_since = None
+        waiting = True
+        if self.capture != None:
+            self.capture.mark('main loop', run_id=run.run_id.decode(), fn=run.fn, length=run.length,
+                              buffered=run.buffered)
+        if self.metrics != None:
+            self.metrics.run = run
+        run.ring.start()
+        # Also when the run ends with sys.exit or an error, so a caller that
+        # catches it, like sweep.py, is not left with a fill thread running
+        try:
+            while True:
+                try:
+                    c = self.read(1)
+                    if c == b'':
+                        if idle_timeout != None:
+                            # Give up once the console stops latching
+                            now = time.monotonic()
+                            if idle_since == None:
+                                idle_since = now
+                            elif now - idle_since > idle_timeout:
+                                print(f'No latches for {idle_timeout} seconds. Stopping.')
+                                break
+                        continue
+                    idle_since = None
+                    if waiting:
+                        run.first_latch = time.time()
+                        waiting = False
+                    numBytes = self.ser.inWaiting()
+                    if numBytes > 0:
+                        c += self.read(numBytes)
+                        if numBytes > int_buffer:
+                            print ("WARNING: High latch rate detected: " + str(numBytes))
+                    latches = c.count(run.run_id)
+                    bulk = c.count(run.run_id.lower())
+                    missed = c.count(b'\xB0')
+                    if missed != 0:
+                        run.fn -= missed
+                        level = int_buffer
+                        stats.overflows += missed
+                        print('Buffer Overflow x{}'.format(missed))
+
+                    # Latch Trains
+                    trainskips = c.count(b'UA')
+                    if trainskips != 0:
+                        stats.train_skips += trainskips
+                        print(f'--- Extra frame detected. Skipping a frame to compensate. x{trainskips}')
+                    trainextra = c.count(b'UB')
+                    if trainextra != 0:
+                        stats.train_extras += trainextra
+                        print(f'--- Short a frame. Adding a frame to compensate. x{trainextra}')
+                    trainfin = c.count(b'UC')
+                    if trainfin != 0:
+                        stats.train_success += trainfin
+                        print(f'+++ Latch train success! x{trainfin}')
+                    trainfailed = c.count(b'UF')
+                    if trainfailed != 0:
+                        stats.train_failed += trainfailed
+                        print(f'!!! Off by many frames. Run is probably broken. Good luck! x{trainfailed}')
+                        sys.exit(1)
+
+                    stats.latches += latches
+                    stats.bulk += bulk
+                    if latches != 0:
+                        level = max(0, level - latches)
+                    if bulk != 0:
+                        level = max(0, min(level, int_buffer - bulk * latches_per_bulk_command))
+                    if latches != 0 or bulk != 0:
+                        stats.buffer_level = level
+                        if level < stats.buffer_low:
+                            stats.buffer_low = level
+                    if latches != 0:
+                        # Latches past the end of the movie get nothing sent
+                        sent = max(0, min(latches, run.length - run.fn))
+                        if sent != 0:
+                            data = run.ring.read(run.fn, sent)
+                            for latch in range(sent):
+                                self.write(data[latch * stride:(latch + 1) * stride])
+                            report_latches(run.fn, run.fn + sent)
+                        run.fn += latches
+                        frame += latches
+                        level += sent
+                    for cmd in range(bulk):
+                        for packet in range(packets):
+                            # The ring pads with blank frames once the movie runs out
+                            self.write(run.ring.read(run.fn, per_packet))
+                            report_latches(run.fn, min(run.fn + per_packet, run.length))
+                            run.fn += per_packet
+                            frame += per_packet
+                        self.write(run.run_id.lower())
+                        level += latches_per_bulk_command
+                    if cursor != None:
+                        cursor.set(run.fn)
+                    if run.fn >= next_event:
+                        # Close to or past a transition or the end of a latch train
+                        staged, fired = schedule.update(run.fn)
+                        for event in staged:
+                            run.ring.stage(event.frame + int_buffer)
+                        for event in fired:
+                            print(f'>>> Sent the frame of the {event}')
+                        next_event = schedule.next_frame
+                    if frame > frame_max:
+                        break
+                except serial.SerialException:
+                    print('ERROR: Serial Exception caught!')
                     break
-            except serial.SerialException:
-                print('ERROR: Serial Exception caught!')
-                break
-            except KeyboardInterrupt:
-                print('^C Exiting')
-                break
+                except KeyboardInterrupt:
+                    print('^C Exiting')
+                    break
+        finally:
+            run.ring.stop()
+            if cursor != None:
+                cursor.set(cursor.IDLE)
+
+def report_latches(start, stop):
+    # Same progress output as printing every 100th frame as it is sent
+    for fn in range(-(-start // 100) * 100, stop, 100):
+        print('Sending Latch: {}'.format(fn))
+
+def at_exit(callback):
+    # atexit handlers are skipped in replay processes started by multiprocessing,
+    # its finalizers run there and, through atexit, in plain scripts as well
+    from multiprocessing import util
+    util.Finalize(None, callback, exitpriority=10)
+
+def start_capture(dev, path, run_id, console, players, movie, start, blank):
+    # Log everything from here on; the log is finished even when the run exits early
+    import capture
+    dev.capture = capture.CaptureLog(path)
+    at_exit(dev.capture.close)
+    dev.capture.mark('run', run_id=run_id.decode(), console=console, players=players, movie=movie,
+                     start=start, blank=blank)
+
+class RunStats:
+    # What main_loop has received so far, counted as it goes
+    __slots__ = ('latches', 'bulk', 'overflows', 'train_skips', 'train_extras', 'train_success', 'train_failed',
+                 'buffer_level', 'buffer_low')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
 
 class RunObject:
-    def __init__(self, run_id, buffer, fn, blankframe):
+    __slots__ = ('run_id', 'buffer', 'fn', 'blankframe', 'length', 'ring', 'schedule', 'stats', 'idle_timeout',
+                 'buffered', 'first_latch')
+
+    def __init__(self, run_id, buffer, fn, blankframe, ring=None, schedule=None, idle_timeout=None, buffered=None):
         self.run_id = run_id
-        self.buffer = buffer
         self.fn = fn
+        # Frames the prefill left in the device, blank frames included
+        self.buffered = fn if buffered == None else buffered
         self.blankframe = blankframe
+        # Optional schedule.EventSchedule of the transitions and latch trains
+        self.schedule = schedule
+        self.stats = RunStats()
+        # Wall clock time main_loop first heard from the device
+        self.first_latch = None
+        # Seconds without any data from the device after which main_loop returns
+        self.idle_timeout = idle_timeout
+        if ring == None:
+            # Lists of per-frame bytes from the decoders are packed into one block
+            self.buffer = FrameBuffer.from_frames(buffer, len(blankframe))
+            ring = FrameRing(self.buffer, run_id, blankframe)
+        else:
+            self.buffer = buffer
+        self.length = ring.length
+        self.ring = ring
+
+def loop_stages(dev, run, stages, profile=None):
+    # main_loop, with the wait for the console's first latch timed on its own
+    powered = time.time()
+    try:
+        profiled(profile, dev.main_loop, run)
+    finally:
+        if run.first_latch != None:
+            stages.add('wait for first latch', powered, run.first_latch)
+            stages.add('main loop', run.first_latch, time.time(), latches=run.stats.latches)
+        else:
+            stages.add('main loop', powered, time.time(), latches=0)
+
+def stream_main(dev, run_id, stream, args, stages):
+    # Play a compiled stream: every packet is already encoded, so prefill the
+    # device straight from the mapped file and let main_loop do the same
+    if args.transition != None:
+        with stages.stage('transitions', count=len(args.transition)):
+            for transition in args.transition:
+                dev.send_transition(run_id, *transition)
+    with stages.stage('prefill') as info:
+        fn = min(int_buffer, len(stream))
+        data = stream.read(0, fn)
+        for latch in range(fn):
+            dev.write(data[latch * stream.stride:(latch + 1) * stream.stride])
+        report_latches(0, fn)
+        err = dev.read(int_buffer)
+        fn -= err.count(b'\xB0')
+        if err.count(b'\xB0') != 0:
+            print('Buffer Overflow x{}'.format(err.count(b'\xB0')))
+        info['frames'] = fn
+    if args.latchtrain != '':
+        with stages.stage('latch train', count=len(args.latchtrain)):
+            dev.send_latchtrain(run_id, args.latchtrain)
+
+    # The stream's frame numbers include the blank frames in front of the movie
+    events = EventSchedule(args.transition, args.latchtrain or None, offset=stream.blank_count)
+    run = RunObject(run_id, stream, fn, stream.blank[len(run_id):], ring=stream, schedule=events)
+    print('Main Loop Start')
+    if not args.nobulk:
+        dev.set_bulk_data_mode(run_id, b"1")
+    dev.power_on()
+    loop_stages(dev, run, stages, args.profile)
+    print('Exiting')
+    stream.close()
+    dev.ser.close()
+    sys.exit(0)
 
 def main():
+    import tascompile
+
     global DEBUG
     global buffer
     global run_id
@@ -306,6 +472,9 @@ def main():
 
     args = parser.parse_args()
 
+    stages = StageTrace(args.trace)
+    at_exit(stages.save)
+
     if args.transition != None:
         for transition in args.transition:
             transition[0] = int(transition[0])
@@ -328,14 +497,18 @@ def main():
         args.players[x] = int(args.players[x])
 
     if args.serial == None:
-        dev = TAStm32(serial_helper.select_serial_port())
+        port = serial_helper.select_serial_port()
     else:
-        dev = TAStm32(args.serial)
+        port = args.serial
+    with stages.stage('open serial') as info:
+        dev = TAStm32(port)
+        info['attempts'] = dev.open_attempts
 
     if args.hardreset or args.softreset:
-        dev.power_off()
-        if args.hardreset:
-            time.sleep(2.0)
+        with stages.stage('power off', hard=args.hardreset):
+            dev.power_off()
+            if args.hardreset:
+                time.sleep(2.0)
 
     if args.clock != None:
         args.clock = int(args.clock)
@@ -343,67 +516,93 @@ def main():
             print('ERROR: The clock value must be in the range [0,63]! Exiting.')
             sys.exit(0)
 
+    stream = None
     try:
-        with open(args.movie, 'rb') as f:
-            data = f.read()
+        with stages.stage('open movie'):
+            if tascompile.is_stream(args.movie):
+                stream = tascompile.CompiledStream(args.movie)
+            else:
+                with open(args.movie, 'rb') as f:
+                    data = f.read()
     except:
         print('ERROR: the specified file (' + args.movie + ') failed to open')
         sys.exit(0)
+    if stream != None:
+        # Compiled streams already contain the blank frames and the setup they were built for
+        cbyte, pbyte, sbyte = setup_bytes(args.console, args.players, args.dpcm, args.overread, args.clock)
+        if (stream.console, stream.players, stream.settings) != (cbyte, pbyte, sbyte):
+            print('ERROR: the compiled stream was built for a different console, players or settings! Exiting.')
+            sys.exit(0)
+        if args.start != 0 or args.blank != 0:
+            print('ERROR: --start and --blank must be set when compiling the stream! Exiting.')
+            sys.exit(0)
 
-    dev.reset()
-    run_id = dev.setup_run(args.console, args.players, args.dpcm, args.overread, args.clock)
+    with stages.stage('reset'):
+        dev.reset()
+    with stages.stage('setup run'):
+        run_id = dev.setup_run(args.console, args.players, args.dpcm, args.overread, args.clock)
     if run_id == None:
         raise RuntimeError('ERROR')
         sys.exit()
-    if args.console == 'n64':
-        buffer = m64.read_input(data)
-        blankframe = b'\x00\x00\x00\x00' * len(args.players)
-    elif args.console == 'snes':
-        buffer = r16m.read_input(data, args.players)
-        blankframe = b'\x00\x00' * len(args.players)
-    elif args.console == 'nes':
-        buffer = r08.read_input(data, args.players)
-        blankframe = b'\x00' * len(args.players)
-    elif args.console == 'gc':
-        buffer = dtm.read_input(data)
-        blankframe = b'\x00\x00\x00\x00\x00\x00\x00\x00' * len(args.players)
-    elif args.console == 'genesis':
-        buffer = rgen.read_input(data, args.players)
-        blankframe = b'\x00\x00' * len(args.players)
+    if args.metrics_port != None or args.metrics_file != None:
+        import metrics
+        metrics.start(dev, args.metrics_port, args.metrics_file)
+    if args.capture != None:
+        start_capture(dev, args.capture, run_id, args.console, args.players, os.path.abspath(args.movie),
+                      args.start, args.blank)
+    if stream != None:
+        if stream.prefix != run_id:
+            print(f'ERROR: the compiled stream uses run {stream.prefix.decode()} but the device assigned run {run_id.decode()}! Exiting.')
+            sys.exit(0)
+        stream_main(dev, run_id, stream, args, stages)
+    with stages.stage('decode', jobs=args.jobs) as info:
+        buffer, blankframe = decode_movie(args.console, data, args.players, jobs=args.jobs)
+        info['frames'] = len(buffer)
+    if args.start != 0:
+        if args.start < 0 or args.start >= len(buffer):
+            print(f'ERROR: The start frame must be in the range [0,{len(buffer) - 1}]! Exiting.')
+            sys.exit(0)
+        print(f'Starting at frame {args.start}')
+        buffer = buffer[args.start:]
 
     # Transitions
+    args.transition = seek_transitions(args.transition, args.start)
     if args.transition != None:
-        for transition in args.transition:
-            dev.send_transition(run_id, *transition)
-    # Send Blank Frames
-    for blank in range(args.blank):
-        data = run_id + blankframe
-        dev.write(data)
-    print(f'Sending Blank Latches: {args.blank}')
-    fn = 0
-    for latch in range(int_buffer-args.blank):
-        try:
+        with stages.stage('transitions', count=len(args.transition)):
+            for transition in args.transition:
+                dev.send_transition(run_id, *transition)
+    with stages.stage('prefill', blank=args.blank) as info:
+        # Send Blank Frames
+        for blank in range(args.blank):
+            data = run_id + blankframe
+            dev.write(data)
+        print(f'Sending Blank Latches: {args.blank}')
+        fn = 0
+        for latch in range(min(int_buffer-args.blank, len(buffer))):
             data = run_id + buffer[fn]
             dev.write(data)
             if fn % 100 == 0:
                 print(f'Sending Latch: {fn}')
             fn += 1
-        except IndexError:
-            pass
-    err = dev.read(int_buffer)
-    fn -= err.count(b'\xB0')
-    if err.count(b'\xB0') != 0:
-        print('Buffer Overflow x{}'.format(err.count(b'\xB0')))
+        err = dev.read(int_buffer)
+        fn -= err.count(b'\xB0')
+        if err.count(b'\xB0') != 0:
+            print('Buffer Overflow x{}'.format(err.count(b'\xB0')))
+        info['frames'] = fn
     # Latch trains
     if args.latchtrain != '':
-        dev.send_latchtrain(run_id, args.latchtrain)
+        args.latchtrain = seek_latchtrain(args.latchtrain, args.start)
+        if args.latchtrain != []:
+            with stages.stage('latch train', count=len(args.latchtrain)):
+                dev.send_latchtrain(run_id, args.latchtrain)
     
-    run = RunObject(run_id, buffer, fn, blankframe)
+    events = EventSchedule(args.transition, args.latchtrain or None)
+    run = RunObject(run_id, buffer, fn, blankframe, schedule=events, buffered=args.blank + fn)
     print('Main Loop Start')
     if not args.nobulk:
         dev.set_bulk_data_mode(run_id, b"1")
     dev.power_on()
-    dev.main_loop(run)
+    loop_stages(dev, run, stages, args.profile)
     print('Exiting')
     dev.ser.close()
     sys.exit(0)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import threading
+
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+class StageTrace:
+    '''
+    How long every stage of a run took, as a Chrome trace.
+
+    The file opens in chrome://tracing or ui.perfetto.dev. Timestamps are
+    wall clock microseconds, so a stage that began in the GUI, like starting
+    the replay process, lines up with the stages the replay process timed.
+    Without a path nothing is written, so runs can time their stages
+    unconditionally.
+    '''
+
+    def __init__(self, path: Optional[str] = None) -> None:
+
+        self.path = path
+        self.events: list = []
+        self.pid = os.getpid()
+
+    def add(self, name: str, start: float, stop: float, **args) -> None:
+
+        self.events.append({'name': name, 'cat': 'run', 'ph': 'X', 'pid': self.pid,
+                            'tid': threading.get_ident(), 'ts': round(start * 1e6),
+                            'dur': round((stop - start) * 1e6), 'args': args})
+
+    @contextmanager
+    def stage(self, name: str, **args):
+
+        # The yielded dict ends up in the event, so a stage can report what it found
+        start = time.time()
+        try:
+            yield args
+        finally:
+            self.add(name, start, time.time(), **args)
+
+    def save(self) -> None:
+
+        if self.path == None:
+            return
+        with open(self.path, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+
+def profiled(path: Optional[str], function: Callable, *args):
+
+    # Run function under cProfile when path is set and write the stats there
+    # once it returns, exits or is interrupted
+    if path == None:
+        return function(*args)
+    import cProfile
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function, *args)
+    finally:
+        profiler.dump_stats(path)
+        print(f'Profile written to {path}, view it with python -m pstats {path}')
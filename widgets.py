@@ -1,8 +1,12 @@
 
 import tkinter as tk
+import tkinter.ttk as ttk
+from bisect import bisect_left, bisect_right
 from collections import defaultdict as ddict
 from typing import Optional, Callable         
 
+import consoles
+
 class ControllerSelector(tk.Frame):
 
     def __init__(self, parent: tk.Frame, controllers: str = "1", console: Optional[str] = None, **kwargs) -> None:
@@ -66,18 +70,10 @@ class ControllerSelector(tk.Frame):
 
     def lockBoxes(self, console: Optional[str] = None) -> None:
 
-        if console == "nes":
-            valid: list = [1, 5]
-        elif console == "snes":
-            valid = [1, 2, 3, 4, 5, 6, 7, 8]
-        elif console == "n64":
-            valid = [1, 2]
-        elif console == "gamecube":
-            valid = [1]
-        elif console == "genesis":
-            valid = [1, 5]
-        else:
-            valid = [1, 2, 3, 4, 5, 6, 7, 8]
+        try:
+            valid: tuple = consoles.get(console).players
+        except (RuntimeError, AttributeError):
+            valid = (1, 2, 3, 4, 5, 6, 7, 8)
         for i in range(8):
             if i + 1 in valid:
                 self.checkbuttons[i].config(state = tk.NORMAL)
@@ -92,136 +88,446 @@ class ControllerSelector(tk.Frame):
 
 class TransitionsTable(tk.Frame):
 
+    #Transition letter <-> name shown in the table
+    names: dict = {"A": "ACE mode",
+                   "N": "Normal mode",
+                   "S": "Soft reset",
+                   "H": "Hard reset"}
+    letters: dict = {name: letter for letter, name in names.items()}
+
     def __init__(self, parent: tk.Frame, transitions: Optional[str] = None, trace: Optional[Callable] = None, **kwargs) -> None:
 
         super().__init__(parent, kwargs)
         self.grid_columnconfigure(0, weight = 3)
         self.grid_columnconfigure(1, weight = 1)
 
-        self.count: int = 0
+        #Model: rows sorted by frame as [frame, letter, tree item], with the
+        #frames alone kept alongside for bisecting. Letter X marks a missing type
+        self.frames: list = []
         self.rows: list = []
-        self.running: bool = False
-        self.cb: Callable = self.register(self.tableUpdateCallback)
+        self.text: Optional[str] = ""
         self.trace = trace
+        self.editor: Optional[tk.Widget] = None
+        self.nextId: int = 0
 
         label: tk.Label = tk.Label(self, text = "Transitions")
-        label.grid(row = 0, column = 0, columnspan = 2)
+        label.grid(row = 0, column = 0, columnspan = 3)
+
+        #Only the visible rows of a Treeview are drawn, however many there are
+        self.tree: ttk.Treeview = ttk.Treeview(self,
+                                               columns = ("frame", "transition"),
+                                               show = "headings",
+                                               height = 6)
+        self.tree.heading("frame", text = "Frame")
+        self.tree.heading("transition", text = "Transition")
+        self.tree.column("frame", width = 100)
+        self.tree.column("transition", width = 100)
+        self.tree.grid(row = 1, column = 0, columnspan = 2, sticky = tk.E + tk.W)
+        scrollbar: tk.Scrollbar = tk.Scrollbar(self, command = self.tree.yview)
+        self.tree.config(yscrollcommand = scrollbar.set)
+        scrollbar.grid(row = 1, column = 2, sticky = tk.N + tk.S)
+        self.tree.bind("<Double-1>", self.edit)
+        self.tree.bind("<Delete>", lambda event: self.removeSelected())
+
+        #New row
+        self.cb: Callable = self.register(self.validateFrame)
+        self.newFrame: tk.StringVar = tk.StringVar(self, "")
+        entry: tk.Entry = tk.Entry(self,
+                                   textvariable = self.newFrame,
+                                   validate = "key",
+                                   validatecommand = (self.cb, "%P"))
+        entry.grid(row = 2, column = 0, sticky = tk.E + tk.W)
+        entry.bind("<Return>", lambda event: self.addRow())
+        self.newType: tk.StringVar = tk.StringVar(self, "")
+        options: tk.OptionMenu = tk.OptionMenu(self, self.newType, *self.names.values())
+        options.grid(row = 2, column = 1, sticky = tk.E + tk.W)
+        buttons: tk.Frame = tk.Frame(self)
+        tk.Button(buttons, text = "Add", command = self.addRow).pack(side = tk.LEFT, fill = "x", expand = True)
+        tk.Button(buttons, text = "Remove", command = self.removeSelected).pack(side = tk.LEFT, fill = "x", expand = True)
+        buttons.grid(row = 3, column = 0, columnspan = 2, sticky = tk.E + tk.W)
 
         if transitions != "" and transitions != None:
-            split = transitions.split(" ")
-            for i in range(0, len(split), 2):
-                self.addRow(split[i:i + 2])
-                
-        self.addRow()   
-        self.running = True
+            self.set(transitions, notify = False)
+
+    def validateFrame(self, what: str) -> bool:
+
+        return what.isnumeric() or what == ""
+
+    def changed(self) -> None:
+
+        self.text = None
+        if self.trace != None:
+            self.trace()
+
+    def position(self, item: str) -> int:
+
+        #Index of a tree item in the model
+        frame: int = int(self.tree.set(item, "frame"))
+        index: int = bisect_left(self.frames, frame)
+        while self.rows[index][2] != item:
+            index += 1
+        return index
+
+    def insert(self, frame: int, letter: str, index: Optional[int] = None) -> None:
+
+        if index == None:
+            index = bisect_right(self.frames, frame)
+        item: str = f"t{self.nextId}"
+        self.nextId += 1
+        self.frames.insert(index, frame)
+        self.rows.insert(index, [frame, letter, item])
+        self.tree.insert("", index, iid = item, values = (frame, self.names.get(letter, "Choose")))
+
+    def delete(self, index: int) -> None:
+
+        self.tree.delete(self.rows[index][2])
+        del self.frames[index]
+        del self.rows[index]
 
     def addRow(self, transition: Optional[list] = None) -> None:
 
-        entryVar: tk.StringVar = tk.StringVar(self, transition[0] if transition != None else "")
-        entry: tk.Entry = tk.Entry(self,
-                                   name = str(self.count + 1),
-                                   textvariable = entryVar,
+        if transition == None:
+            transition = [self.newFrame.get(), self.letters.get(self.newType.get(), "X")]
+            self.newFrame.set("")
+        if not str(transition[0]).isnumeric():
+            return
+        self.insert(int(transition[0]), transition[1] if transition[1] in self.names else "X")
+        self.changed()
+
+    def removeSelected(self) -> None:
+
+        selected: tuple = self.tree.selection()
+        if len(selected) == 0:
+            return
+        for item in selected:
+            self.delete(self.position(item))
+        self.changed()
+
+    def edit(self, event: tk.Event) -> None:
+
+        #Edit a cell in place with a widget laid over it
+        self.closeEditor()
+        item: str = self.tree.identify_row(event.y)
+        column: str = self.tree.identify_column(event.x)
+        if item == "" or column not in ("#1", "#2"):
+            return
+        x, y, width, height = self.tree.bbox(item, column)
+        if column == "#1":
+            var: tk.StringVar = tk.StringVar(self, self.tree.set(item, "frame"))
+            self.editor = tk.Entry(self.tree,
+                                   textvariable = var,
                                    validate = "key",
-                                   validatecommand = (self.cb, "%W", "%P"))
-        optionsVar: tk.StringVar = tk.StringVar(self, transition[1] if transition != None else "")
-        options: tk.OptionMenu = tk.OptionMenu(self,
-                                               optionsVar,
-                                               *["ACE mode",
-                                                 "Normal mode",
-                                                 "Soft reset",
-                                                 "Hard reset"])
-        entry.grid(row = self.count + 1, column = 0, sticky = tk.E + tk.W)
-        options.grid(row = self.count + 1, column = 1, sticky = tk.E + tk.W)
-        if self.trace != None:
-            entryVar.trace_add("write", self.trace)
-            optionsVar.trace_add("write", self.trace)
-        self.rows.append({"entryVar": entryVar,
-                          "entry": entry,
-                          "optionsVar": optionsVar,
-                          "options": options})
-        self.count += 1
-
-    def removeRow(self) -> None:
-
-        del self.rows[-1]["entryVar"]
-        self.rows[-1]["entry"].destroy()
-        del self.rows[-1]["optionsVar"]
-        self.rows[-1]["options"].destroy()
-        self.rows.pop(-1)
-        self.count -= 1
+                                   validatecommand = (self.cb, "%P"))
+        else:
+            var = tk.StringVar(self, self.tree.set(item, "transition"))
+            self.editor = ttk.Combobox(self.tree,
+                                       textvariable = var,
+                                       values = list(self.names.values()),
+                                       state = "readonly")
+            self.editor.bind("<<ComboboxSelected>>", lambda event: self.commit(item, column, var.get()))
+        self.editor.place(x = x, y = y, width = width, height = height)
+        self.editor.focus_set()
+        self.editor.bind("<Return>", lambda event: self.commit(item, column, var.get()))
+        #Wait until the focus has moved to see where it went
+        editor: tk.Widget = self.editor
+        self.editor.bind("<FocusOut>", lambda event: self.after_idle(self.leaveEditor, editor, item, column, var))
+        self.editor.bind("<Escape>", lambda event: self.closeEditor())
+
+    def leaveEditor(self, editor: tk.Widget, item: str, column: str, var: tk.StringVar) -> None:
+
+        #Clicking away commits the edit. Opening the combobox's list moves the
+        #focus to its popdown, which is still part of the editor
+        if self.editor is not editor:
+            return
+        focus: str = str(self.tk.call("focus"))
+        if focus == str(editor) or focus.startswith(str(editor) + "."):
+            return
+        self.commit(item, column, var.get())
+
+    def commit(self, item: str, column: str, value: str) -> None:
+
+        if self.editor == None:
+            return
+        self.closeEditor()
+        if not self.tree.exists(item):
+            return
+        index: int = self.position(item)
+        frame, letter, item = self.rows[index]
+        if column == "#1":
+            if not value.isnumeric() or int(value) == frame:
+                return
+            #Moving a row keeps the model sorted
+            self.delete(index)
+            self.insert(int(value), letter)
+        else:
+            if self.letters.get(value, "X") == letter:
+                return
+            self.rows[index][1] = self.letters.get(value, "X")
+            self.tree.set(item, "transition", value)
+        self.changed()
+
+    def closeEditor(self) -> None:
+
+        if self.editor != None:
+            editor: tk.Widget = self.editor
+            self.editor = None
+            editor.destroy()
 
     def get(self) -> str:
 
-        output: str = ""
-
-        for row in self.rows:
-            if output != "":
-                output += " "
-            frame: str = row['entryVar'].get()
-            transition: str = row['optionsVar'].get()
-            
-            if transition == "ACE mode":
-                transition = "A"
-            elif transition == "Normal mode":
-                transition = "N"
-            elif transition == "Soft reset":
-                transition = "S"
-            elif transition == "Hard reset":
-                transition = "H"
-                
-            if frame.isnumeric():
-                output += f"{frame} {'X' if transition not in ['A', 'N', 'S', 'H'] else transition}"
-
-        return output.strip()
-
-    def set(self, transitions: str) -> None:
-
-        self.running = False
-        while self.count > 0:
-            self.removeRow()
-        if transitions != "":
-            for transition in transitions.split(" "):
-                self.addRow()
-                self.rows[-1]["entryVar"].set(transition[0])
-                ttype: str = transition[1]
-                if ttype == "A":
-                    ttype = "ACE mode"
-                elif ttype == "N":
-                    ttype = "Normal mode"
-                elif ttype == "S":
-                    ttype = "Soft reset"
-                elif ttype == "H":
-                    ttype = "Hard reset"
-                self.rows[-1]["optionsVar"].set(ttype)
-        self.addRow()
-        self.running = True
-
-    def tableUpdateCallback(self, who: str, what: str) -> bool:
-
-        #First, we should probably actually validate the result
-        if what.isnumeric() == False and what != "":
-            return False
-
-        #Do not add rows if the program is modifying the vars
-        if not self.running:
-            return True
-
-        #Check if it needs to add a row
-        if who.split(".")[-1] == str(self.count):
-            if what != "":
-                self.addRow()
-            return True
-
-        #Check if it needs to remove a row
-        if who.split(".")[-1] == str(self.count - 1):
-            if what == "":
-                self.removeRow()
-            return True
-
-        #Always return a boolean
-        return True
+        #Rebuilt only after a change
+        if self.text == None:
+            self.text = " ".join(f"{frame} {letter}" for frame, letter, item in self.rows)
+        return self.text
+
+    def set(self, transitions: str, notify: bool = True) -> None:
+
+        split: list = transitions.split(" ") if transitions != "" else []
+        new: list = sorted(((int(split[i]), split[i + 1] if split[i + 1] in self.names else "X")
+                            for i in range(0, len(split) - 1, 2) if split[i].isnumeric()),
+                           key = lambda transition: transition[0])
+        #Only the rows between the unchanged start and end are replaced
+        old: list = [(frame, letter) for frame, letter, item in self.rows]
+        start: int = 0
+        while start < min(len(old), len(new)) and old[start] == new[start]:
+            start += 1
+        end: int = 0
+        while end < min(len(old), len(new)) - start and old[-1 - end] == new[-1 - end]:
+            end += 1
+        if start == len(old) == len(new):
+            return
+        self.closeEditor()
+        for index in range(len(old) - end - 1, start - 1, -1):
+            self.delete(index)
+        for index, (frame, letter) in enumerate(new[start:len(new) - end], start):
+            self.insert(frame, letter, index)
+        self.text = None
+        if notify:
+            self.changed()
+
+class InputDisplay(tk.Frame):
+
+    def __init__(self, parent: tk.Frame, fps: int = 30, **kwargs) -> None:
 
-        
+        super().__init__(parent, kwargs)
+        self.grid_columnconfigure(1, weight = 1)
+        self.grid_columnconfigure(2, weight = 1)
+
+        #Redraws are capped at fps and only happen when the frame changed
+        self.interval: int = max(1, 1000 // fps)
+        self.rows: list = []
+        self.cursor = None
+        self.frames = None
+        self.console = None
+        self.running: Optional[Callable] = None
+        self.job: Optional[str] = None
+        self.last: Optional[int] = None
+
+        label: tk.Label = tk.Label(self, text = "Input Display")
+        label.grid(row = 0, column = 0, columnspan = 3)
+        self.status: tk.StringVar = tk.StringVar(self, "Not running")
+        tk.Label(self, textvariable = self.status).grid(row = 1, column = 0)
+        tk.Label(self, text = "Sent").grid(row = 1, column = 1)
+        tk.Label(self, text = "Next").grid(row = 1, column = 2)
+
+    def watch(self, cursor, frames, console: consoles.ConsoleFormat, running: Callable) -> None:
+
+        #Follow the frame a replay process publishes to cursor until running() is False
+        self.stop()
+        while len(self.rows) > 0:
+            for widget in self.rows.pop(-1)["widgets"]:
+                widget.destroy()
+        self.cursor = cursor
+        self.frames = frames
+        self.console = console
+        self.running = running
+        self.last = None
+        #The decoders decide how many players a frame holds (GC keeps every controller)
+        for player in range(frames.stride // console.frame_size):
+            sentVar: tk.StringVar = tk.StringVar(self, "")
+            nextVar: tk.StringVar = tk.StringVar(self, "")
+            widgets: list = [tk.Label(self, text = f"P{player + 1}"),
+                             tk.Label(self, textvariable = sentVar, width = 30, anchor = tk.W),
+                             tk.Label(self, textvariable = nextVar, width = 30, anchor = tk.W)]
+            for column, widget in enumerate(widgets):
+                widget.grid(row = player + 2, column = column, sticky = tk.E + tk.W)
+            self.rows.append({"sentVar": sentVar,
+                              "nextVar": nextVar,
+                              "widgets": widgets})
+        self.job = self.after(self.interval, self.poll)
+
+    def poll(self) -> None:
+
+        self.job = None
+        fn: int = self.cursor.get()
+        if fn != self.last:
+            self.draw(fn)
+            self.last = fn
+        if self.running():
+            self.job = self.after(self.interval, self.poll)
+        else:
+            self.stop()
+
+    def draw(self, fn: int) -> None:
+
+        if fn < 0:
+            self.status.set("Waiting")
+            for row in self.rows:
+                row["sentVar"].set("")
+                row["nextVar"].set("")
+            return
+        length: int = len(self.frames)
+        self.status.set(f"Frame {min(fn, length)}/{length}")
+        size: int = self.console.frame_size
+        sent: Optional[bytes] = self.frames[fn - 1] if 0 < fn <= length else None
+        upcoming: Optional[bytes] = self.frames[fn] if fn < length else None
+        for player, row in enumerate(self.rows):
+            for var, frame in ((row["sentVar"], sent), (row["nextVar"], upcoming)):
+                if frame == None:
+                    var.set("")
+                else:
+                    var.set(" ".join(self.console.pressed(frame[player * size:(player + 1) * size])) or "-")
+
+    def stop(self) -> None:
+
+        if self.job != None:
+            self.after_cancel(self.job)
+            self.job = None
+        if self.cursor != None:
+            self.status.set("Not running")
+        self.cursor = None
+        self.running = None
+
+class Timeline(tk.Frame):
+
+    def __init__(self, parent: tk.Frame, height: int = 60, **kwargs) -> None:
+
+        super().__init__(parent, kwargs)
+        self.grid_columnconfigure(0, weight = 1)
+
+        self.index = None
+        self.transitions: list = []
+        self.trains: list = []
+        self.first: float = 0
+        self.span: float = 1
+        self.height: int = height
+
+        self.info: tk.StringVar = tk.StringVar(self, "Timeline")
+        tk.Label(self, textvariable = self.info).grid(row = 0, column = 0, sticky = tk.E + tk.W)
+        self.canvas: tk.Canvas = tk.Canvas(self, height = height, bg = "white", highlightthickness = 0)
+        self.canvas.grid(row = 1, column = 0, sticky = tk.E + tk.W)
+        self.scrollbar: tk.Scrollbar = tk.Scrollbar(self, orient = tk.HORIZONTAL, command = self.scroll)
+        self.scrollbar.grid(row = 2, column = 0, sticky = tk.E + tk.W)
+
+        self.canvas.bind("<Configure>", lambda event: self.redraw())
+        self.canvas.bind("<Motion>", self.hover)
+        self.canvas.bind("<MouseWheel>", lambda event: self.zoom(event.x, 0.8 if event.delta > 0 else 1.25))
+        self.canvas.bind("<Button-4>", lambda event: self.zoom(event.x, 0.8))
+        self.canvas.bind("<Button-5>", lambda event: self.zoom(event.x, 1.25))
+
+    def setIndex(self, index) -> None:
+
+        #index is an activity.ActivityIndex, or None to clear the timeline
+        self.index = index
+        self.first = 0
+        self.span = max(1, index.length if index != None else 1)
+        self.redraw()
+
+    def setMarks(self, transitions: str, latchTrain: str) -> None:
+
+        #Same formats as TransitionsTable.get() and the latch train entry
+        split: list = transitions.split(" ") if transitions != "" else []
+        self.transitions = [(int(split[i]), split[i + 1]) for i in range(0, len(split) - 1, 2) if split[i].isnumeric()]
+        self.trains = []
+        end: int = 0
+        for latches in latchTrain.split(","):
+            if latches.strip().isnumeric():
+                end += int(latches)
+                self.trains.append(end)
+        self.redraw()
+
+    def frameAt(self, x: int) -> int:
+
+        width: int = max(1, self.canvas.winfo_width())
+        return int(self.first + x * self.span / width)
+
+    def xOf(self, frame: int) -> float:
+
+        width: int = max(1, self.canvas.winfo_width())
+        return (frame - self.first) * width / self.span
+
+    def redraw(self) -> None:
+
+        canvas: tk.Canvas = self.canvas
+        canvas.delete("all")
+        if self.index == None:
+            self.scrollbar.set(0, 1)
+            return
+        length: int = self.index.length
+        if length == 0:
+            self.scrollbar.set(0, 1)
+            self.info.set("Frames 0-0 of 0")
+            return
+        width: int = max(1, canvas.winfo_width())
+        height: int = self.height
+        perPixel: float = self.span / width
+        level: int = self.index.level_for(perPixel)
+        #One summed span of the index per pixel column; the frames are never read
+        for x in range(width):
+            start: int = int(self.first + x * perPixel)
+            if start >= length:
+                break
+            stop: int = max(start + 1, int(self.first + (x + 1) * perPixel))
+            changes, held, counted = self.index.span(level, start, stop)
+            if changes == 0:
+                canvas.create_line(x, height - 3, x, height, fill = "lightgrey" if held == 0 else "grey")
+            else:
+                bar: float = max(3, height * min(1, (changes / counted) ** 0.5))
+                canvas.create_line(x, height - bar, x, height, fill = "steelblue")
+        for frame in self.trains:
+            if self.first <= frame < self.first + self.span:
+                canvas.create_line(self.xOf(frame), 0, self.xOf(frame), height, fill = "green", dash = (2, 2))
+        for frame, mode in self.transitions:
+            if self.first <= frame < self.first + self.span:
+                x: float = self.xOf(frame)
+                canvas.create_line(x, 0, x, height, fill = "red")
+                canvas.create_text(x + 2, 2, text = mode, anchor = tk.NW, fill = "red")
+        self.scrollbar.set(self.first / length, min(1, (self.first + self.span) / length))
+        self.info.set(f"Frames {int(self.first)}-{int(min(length, self.first + self.span))} of {length}")
+
+    def scroll(self, action: str, amount: str, unit: Optional[str] = None) -> None:
+
+        if self.index == None:
+            return
+        length: int = self.index.length
+        if action == "moveto":
+            self.first = float(amount) * length
+        elif unit == "pages":
+            self.first += int(amount) * self.span * 0.9
+        else:
+            self.first += int(amount) * self.span * 0.1
+        self.first = max(0, min(self.first, length - self.span))
+        self.redraw()
+
+    def zoom(self, x: int, factor: float) -> None:
+
+        if self.index == None or self.index.length == 0:
+            return
+        #Keep the frame under the pointer in place
+        frame: int = self.frameAt(x)
+        width: int = max(1, self.canvas.winfo_width())
+        self.span = max(min(width, self.index.length), min(self.index.length, self.span * factor))
+        self.first = max(0, min(frame - x * self.span / width, self.index.length - self.span))
+        self.redraw()
+
+    def hover(self, event: tk.Event) -> None:
+
+        if self.index == None:
+            return
+        frame: int = self.frameAt(event.x)
+        if frame < self.index.length:
+            changes, held, counted = self.index.span(0, frame, frame + 1)
+            self.info.set(f"Frame {frame}: {changes} changes in its block of {self.index.block}")
 
 if __name__ == "__main__":
     
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+import sys
+import signal
+import multiprocessing as mp
+
+from typing import Callable, Optional
+
+#How long a worker may take to come up before it is replaced
+READY_TIMEOUT = 30.0
+
+#Modules the replay process needs; importing them is most of the cold start cost
+PRELOAD = ["serial", "serial.tools.list_ports", "psutil", "struct",
+           "tastm32", "hook", "r08", "r16m", "m64", "dtm", "rgen"]
+
+def getContext():
+
+    #forkserver keeps one process around with PRELOAD already imported and forks
+    #workers off it, so a new worker costs a fork instead of an interpreter start
+    if "forkserver" in mp.get_all_start_methods():
+        ctx = mp.get_context("forkserver")
+        ctx.set_forkserver_preload(PRELOAD)
+    else:
+        ctx = mp.get_context("spawn")
+    return ctx
+
+def _serve(conn) -> None:
+
+    #On spawn platforms nothing is preloaded, so import everything before
+    #announcing that the worker is ready
+    for module in PRELOAD:
+        try:
+            __import__(module)
+        except ImportError:
+            pass
+    try:
+        conn.send("ready")
+        job = conn.recv()
+    except (EOFError, OSError):
+        #The GUI closed before a job was handed out
+        return
+    finally:
+        conn.close()
+    if job == None:
+        return
+    target, kwargs = job
+    #Stopping a run terminates its process. Turn that into SystemExit so finally
+    #blocks and multiprocessing finalizers still run, e.g. to finish capture logs
+    signal.signal(signal.SIGTERM, _terminated)
+    target(**kwargs)
+
+def _terminated(signum, frame) -> None:
+
+    sys.exit(128 + signum)
+
+class WarmWorker:
+
+    def __init__(self, ctx) -> None:
+
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target = _serve, args = (child,))
+        self.process.start()
+        child.close()
+        self.started: bool = False
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+
+        #True once the worker has finished importing and is waiting for a job,
+        #False if it is still busy or died on the way
+        try:
+            if self.conn.poll(timeout):
+                return self.conn.recv() == "ready"
+        except (EOFError, OSError):
+            pass
+        return False
+
+    def start(self, target: Callable, **kwargs) -> None:
+
+        self.conn.send((target, kwargs))
+        self.conn.close()
+        self.started = True
+
+    def is_alive(self) -> bool:
+
+        return self.process.is_alive()
+
+    def join(self, timeout: Optional[float] = None) -> None:
+
+        self.process.join(timeout)
+
+    def terminate(self) -> None:
+
+        self.process.terminate()
+
+    def close(self) -> None:
+
+        if not self.started and self.process.is_alive():
+            try:
+                self.conn.send(None)
+            except OSError:
+                pass
+            self.process.join(1.0)
+        self.conn.close()
+        if self.process.is_alive():
+            self.process.terminate()
+
+class WorkerPool:
+
+    def __init__(self, size: int = 1) -> None:
+
+        self.ctx = getContext()
+        self.size = size
+        self.idle: list = []
+        self.fill()
+
+    def fill(self) -> None:
+
+        while len(self.idle) < self.size:
+            self.idle.append(WarmWorker(self.ctx))
+
+    def acquire(self) -> WarmWorker:
+
+        #Hand out the oldest idle worker and immediately start warming its replacement.
+        #One that died or hangs is thrown away for a fresh one
+        worker = self.idle.pop(0)
+        if not worker.wait(READY_TIMEOUT):
+            worker.close()
+            worker = WarmWorker(self.ctx)
+            if not worker.wait(READY_TIMEOUT):
+                worker.close()
+                raise RuntimeError('The replay process did not start')
+        self.fill()
+        return worker
+
+    def close(self) -> None:
+
+        for worker in self.idle:
+            worker.close()
+        self.idle = []